@@ -18,6 +18,8 @@ class ChessEvalApp():
     def __init__(self, master: tk.Tk, detector: BoardDetector, recognizer: PositionRecognizer, args: argparse.Namespace):
         # ML model used to recognize pieces on the board and their position
         self.recognizer = recognizer
+        # Recreates the image of the recognized position (default assets loaded once)
+        self.position_renderer = fen_transcode.PositionRenderer()
         # Area on the display to screenshot chess board from
         self.screenshot_area = None
 
@@ -136,14 +138,13 @@ class ChessEvalApp():
         with ImageGrab.grab(bbox=screenshot_area) as screenshot:
             screenshot = screenshot.resize((256, 256))
             image = np.array(screenshot.convert('L'), dtype=np.float32)
-        encoded_pos = self.recognizer.predict(image[None,...,None])[0]
-        encoded_pos = encoded_pos._numpy().astype(np.uint8)
+        encoded_pos = np.asarray(self.recognizer.predict_classes(image[None,...,None]))[0]
         # Check the board orientation
         if not play_as_white:
             encoded_pos = np.flip(encoded_pos, axis=0)
             encoded_pos = np.flip(encoded_pos, axis=1)
         # Reconstruct the image
-        decoded_pos = fen_transcode.decode_position(encoded_pos)
+        decoded_pos = self.position_renderer.render(encoded_pos)
         decoded_pos = Image.fromarray(decoded_pos)
         return screenshot, decoded_pos, encoded_pos
 
@@ -0,0 +1,263 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import numpy as np
+import cv2
+
+import chessrec.constants as const
+from chessrec.compositing import PremultipliedSprite
+
+
+"""
+In-memory stores of decoded (and pre-resized) image assets,
+so the data generator does not touch the disk once warmed up
+"""
+
+def add_alpha_channel(img: np.ndarray) -> np.ndarray:
+    if img.shape[2] < 4:
+      alpha_ch = np.ones_like(img[...,0], dtype=np.uint8)*255
+      img = np.concatenate([img, alpha_ch[...,None]], axis=-1)
+    return img
+
+
+class ByteLRUCache():
+    """
+    Dictionary-like cache bounded by the total size (in bytes) of the stored
+    numpy arrays. The least recently used entries are evicted first.
+    Values are either numpy arrays (or objects with nbytes) or dicts of them.
+    Thread-safe - the same generator is used by the tf.data threads and the
+    replay buffer producer; the loading itself runs outside the lock.
+    """
+    def __init__(self, memory_budget: int) -> None:
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def nbytes(value) -> int:
+        if isinstance(value, dict):
+            return sum(v.nbytes for v in value.values())
+        return value.nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def get(self, key: Hashable, load: Callable):
+        """
+        Returns the cached value for the key; on a miss, the value is
+        created by load() and stored (if it fits into the budget)
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        value = load()
+        self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        size = self.nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.memory_used -= self.nbytes(self._entries.pop(key))
+            if size > self.memory_budget:
+                # Would evict everything and still not fit
+                return
+            while self.memory_used + size > self.memory_budget:
+                _, evicted = self._entries.popitem(last=False)
+                self.memory_used -= self.nbytes(evicted)
+                self.evictions += 1
+            self._entries[key] = value
+            self.memory_used += size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.memory_used = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "memory_used": self.memory_used,
+            "memory_budget": self.memory_budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class SpriteAtlas():
+    """
+    Decoded board images (BGRA) together with the piece sprites of a piece set,
+    already resized to the square size of the board and premultiplied 
+    (compositing.PremultipliedSprite). One atlas entry is keyed
+    by (piece set, board, square size).
+    Returned arrays are shared - callers must copy the board before drawing on it.
+    """
+    DEFAULT_MEMORY_BUDGET: int = 512 * 2**20
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET) -> None:
+        self._cache = ByteLRUCache(memory_budget)
+
+    @property
+    def cache(self) -> ByteLRUCache:
+        return self._cache
+
+    @staticmethod
+    def sprite_dsize(board: np.ndarray) -> tuple[int, int]:
+        """
+        cv2 dsize of the piece sprites for a given board, same convention
+        as in fen_transcode.place_piece_on_board
+        """
+        return (board.shape[0] // const.BOARD_FILES, board.shape[1] // const.BOARD_RANKS)
+
+    @staticmethod
+    def _load_board(board_im: str, square_size: int | None) -> np.ndarray:
+        board = cv2.imread(board_im, cv2.IMREAD_COLOR)
+        board = add_alpha_channel(board)
+        if square_size is not None:
+            board = cv2.resize(
+                board, 
+                (square_size*const.BOARD_FILES, square_size*const.BOARD_RANKS),
+                interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(board)
+
+    @staticmethod
+    def _load_sprites(
+            pieces_set: str, 
+            dsize: tuple[int, int], 
+            interpolation: int = cv2.INTER_LINEAR) -> dict[str, np.ndarray]:
+        sprites = {}
+        for piece in const.PIECES_ENCODING:
+            piece_image = cv2.imread(
+                os.path.join(pieces_set, f'{piece}.png'), cv2.IMREAD_UNCHANGED)
+            piece_image = cv2.resize(piece_image, dsize, interpolation=interpolation)
+            sprites[piece] = np.ascontiguousarray(piece_image)
+        return sprites
+
+    def _load_entry(
+            self,
+            pieces_set: str,
+            board_im: str,
+            square_size: int | None) -> dict[str, np.ndarray]:
+        board = self._load_board(board_im, square_size)
+        entry = {"board": board}
+        sprites = self._load_sprites(pieces_set, self.sprite_dsize(board))
+        entry.update({piece: PremultipliedSprite(sprite) for piece, sprite in sprites.items()})
+        return entry
+
+    def get(
+            self,
+            pieces_set: str,
+            board_im: str,
+            square_size: int | None = None) -> dict[str, np.ndarray]:
+        """
+        Returns dict with the "board" image and one PremultipliedSprite per piece 
+        notation (e.g. "wK"). If square_size is None, the native board resolution is used.
+        """
+        key = (pieces_set, board_im, square_size)
+        return self._cache.get(
+            key, lambda: self._load_entry(pieces_set, board_im, square_size))
+
+    def warm_up(
+            self,
+            pieces_sets: list[str],
+            boards: list[str],
+            square_size: int | None = None) -> None:
+        """
+        Preloads all the combinations of piece sets and boards (as long as
+        they fit into the memory budget)
+        """
+        for pieces_set in pieces_sets:
+            for board_im in boards:
+                self.get(pieces_set, board_im, square_size)
+
+    def _load_stacked(
+            self,
+            pieces_sets: tuple[str, ...],
+            boards: tuple[str, ...],
+            square_size: int) -> dict[str, np.ndarray]:
+        boards_stack = np.stack(
+            [self._load_board(board_im, square_size)[...,:3] for board_im in boards])
+        # Index 0 (empty square) is a fully transparent sprite, the other indices
+        # correspond to const.PIECES_ENCODING
+        sprites_stack = np.zeros(
+            [len(pieces_sets), const.SQUARE_CLASSES, square_size, square_size, 4], dtype=np.uint8)
+        for set_idx, pieces_set in enumerate(pieces_sets):
+            sprites = self._load_sprites(
+                pieces_set, (square_size, square_size), interpolation=cv2.INTER_AREA)
+            for piece, code in const.PIECES_ENCODING.items():
+                sprites_stack[set_idx, code] = sprites[piece]
+        return {"boards": boards_stack, "sprites": sprites_stack}
+
+    def stacked(
+            self,
+            pieces_sets: list[str],
+            boards: list[str],
+            square_size: int) -> dict[str, np.ndarray]:
+        """
+        Returns all the boards as one (n_boards, 8*S, 8*S, 3) array and all the 
+        piece sets as one (n_sets, SQUARE_CLASSES, S, S, 4) array indexed 
+        by the position encoding, S being the square_size. Used by the batched rendering.
+        """
+        key = ("stacked", tuple(pieces_sets), tuple(boards), square_size)
+        return self._cache.get(
+            key, lambda: self._load_stacked(tuple(pieces_sets), tuple(boards), square_size))
+
+
+class BackgroundCache():
+    """
+    Decoded backgrounds (BGRA), resized to a fixed size, keyed by the image path.
+    Cached frames are read-only - callers copy only the region they need.
+    """
+    DEFAULT_MEMORY_BUDGET: int = 256 * 2**20
+
+    def __init__(
+            self, 
+            height: int, 
+            width: int, 
+            memory_budget: int = DEFAULT_MEMORY_BUDGET) -> None:
+        self.height = height
+        self.width = width
+        self._cache = ByteLRUCache(memory_budget)
+
+    @property
+    def cache(self) -> ByteLRUCache:
+        return self._cache
+
+    def _load(self, background_img: str) -> np.ndarray:
+        image = cv2.imread(background_img, cv2.IMREAD_COLOR)
+        image = add_alpha_channel(image)
+        image = cv2.resize(image, (self.width, self.height))
+        image.setflags(write=False)
+        return image
+
+    def get(self, background_img: str) -> np.ndarray:
+        return self._cache.get(background_img, lambda: self._load(background_img))
+
+    def warm_up(self, backgrounds: list[str]) -> None:
+        """
+        Preloads the backgrounds until the memory budget is full
+        """
+        frame_size = self.height * self.width * 4
+        for background_img in backgrounds:
+            if self._cache.memory_used + frame_size > self._cache.memory_budget:
+                break
+            self.get(background_img)
@@ -0,0 +1,191 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import h5py
+import numpy as np
+import tensorflow as tf
+
+
+"""
+Asynchronous checkpointing of the recognizer. Weights are snapshotted in memory
+and written by a background thread, so the training does not wait for the disk.
+"""
+
+def snapshot_weights(model: tf.keras.Model) -> dict:
+    """
+    Copy of the model weights (names and values per layer),
+    written later by write_h5_weights(). Uses only the public weights API.
+    """
+    values = model.get_weights()
+    index = {id(weight): i for i, weight in enumerate(model.weights)}
+    layers, in_layers = [], set()
+    for layer in model.layers:
+        weights = layer.weights
+        in_layers.update(id(weight) for weight in weights)
+        layers.append((layer.name, [w.name for w in weights], [values[index[id(w)]] for w in weights]))
+    top_level = [weight for weight in model.weights if id(weight) not in in_layers]
+    return {
+        "layers": layers,
+        "top_level": ([w.name for w in top_level], [values[index[id(w)]] for w in top_level]),
+    }
+
+
+def _write_weights_group(group: h5py.Group, names: list[str], values: list[np.ndarray]) -> None:
+    group.attrs["weight_names"] = np.array([name.encode("utf8") for name in names])
+    for name, value in zip(names, values):
+        dataset = group.create_dataset(name, value.shape, dtype=value.dtype)
+        dataset[()] = value
+
+
+def write_h5_weights(path: str, snapshot: dict) -> None:
+    """
+    Writes the snapshot in the layout of model.save_weights(save_format="h5"),
+    so it is loaded by RecognizerBase.load_model(). Written to a temporary file
+    first, so a crash never leaves a broken checkpoint.
+    """
+    with h5py.File(path + ".tmp", "w") as f:
+        f.attrs["layer_names"] = np.array([name.encode("utf8") for name, _, _ in snapshot["layers"]])
+        f.attrs["backend"] = tf.keras.backend.backend().encode("utf8")
+        f.attrs["keras_version"] = tf.version.VERSION.encode("utf8")
+        for name, weight_names, values in sorted(snapshot["layers"], key=lambda layer: layer[0]):
+            _write_weights_group(f.create_group(name), weight_names, values)
+        _write_weights_group(f.create_group("top_level_model_weights"), *snapshot["top_level"])
+    os.replace(path + ".tmp", path)
+
+
+class CheckpointManager():
+    """
+    Saves the recognizer after every epoch as f'{save_prefix}_{epoch}.h5' on a background
+    thread. With keep_best > 0, only the best keep_best checkpoints (by the monitored
+    value of the epoch logs) and the latest one are kept on disk, otherwise all of them.
+    The optimizer state is stored next to the latest checkpoint only, which is enough
+    for self.restore() to resume the training. The manifest of a previous run with the
+    same prefix is continued only with resume=True, otherwise a new one is started
+    (and the checkpoints of the previous run are never pruned).
+    """
+    def __init__(
+            self,
+            recognizer: tf.keras.Model,
+            save_prefix: str,
+            keep_best: int = 0,
+            monitor: str = "val_Boad accuracy",
+            resume: bool = False) -> None:
+        self.recognizer = recognizer
+        self.save_prefix = save_prefix
+        self.keep_best = keep_best
+        self.monitor = monitor
+        self.manifest_path = f'{save_prefix}_checkpoints.json'
+        self.manifest = (self._read_manifest() if resume else None) or {
+            "monitor": monitor, "latest": None, "best": [], "saved": []}
+        if "saved" not in self.manifest:
+            # Manifests written before the saved epochs were recorded
+            self.manifest["saved"] = self._saved_epochs()
+        # Single thread, so the checkpoints are written in the order of the epochs
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: list[Future] = []
+
+    def _read_manifest(self) -> dict | None:
+        if not os.path.isfile(self.manifest_path):
+            return None
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self) -> None:
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def weights_path(self, epoch: int) -> str:
+        return f'{self.save_prefix}_{epoch}.h5'
+
+    def optimizer_path(self, epoch: int) -> str:
+        return f'{self.save_prefix}_{epoch}_optimizer.npz'
+
+    def _check_pending(self) -> None:
+        # Re-raises the errors of the finished writes
+        for future in [future for future in self._pending if future.done()]:
+            self._pending.remove(future)
+            future.result()
+
+    def save(self, epoch: int, logs: dict | None = None) -> Future:
+        """
+        Snapshots the weights and the optimizer state and schedules their writing
+        """
+        self._check_pending()
+        score = (logs or {}).get(self.monitor)
+        weights = snapshot_weights(self.recognizer)
+        optimizer_state = tf.keras.backend.batch_get_value(self.recognizer.optimizer.variables)
+        future = self._executor.submit(
+            self._write, epoch, None if score is None else float(score), weights, optimizer_state)
+        self._pending.append(future)
+        return future
+
+    def _write(self, epoch: int, score: float | None, weights: dict, optimizer_state: list) -> None:
+        write_h5_weights(self.weights_path(epoch), weights)
+        np.savez(self.optimizer_path(epoch), *optimizer_state)
+        previous = self.manifest["latest"]
+        self.manifest["latest"] = {"epoch": epoch, "score": score}
+        if score is not None:
+            best = self.manifest["best"] + [{"epoch": epoch, "score": score}]
+            best.sort(key=lambda checkpoint: checkpoint["score"], reverse=True)
+            self.manifest["best"] = best[:self.keep_best] if self.keep_best else best
+        saved = sorted(set(self.manifest["saved"]) | {epoch})
+        stale = []
+        if self.keep_best:
+            kept = {epoch} | {checkpoint["epoch"] for checkpoint in self.manifest["best"]}
+            stale = [e for e in saved if e not in kept]
+        self.manifest["saved"] = [e for e in saved if e not in stale]
+        self._write_manifest()
+        # Files are removed only once the manifest does not refer to them
+        if previous is not None and previous["epoch"] != epoch:
+            self._remove(self.optimizer_path(previous["epoch"]))
+        for e in stale:
+            self._remove(self.weights_path(e))
+
+    def _saved_epochs(self) -> list[int]:
+        directory, prefix = os.path.split(self.save_prefix)
+        epochs = []
+        for name in os.listdir(directory or "."):
+            stem = name[len(prefix) + 1:-len(".h5")]
+            if name.startswith(f'{prefix}_') and name.endswith(".h5") and stem.isdigit():
+                epochs.append(int(stem))
+        return epochs
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def wait(self) -> None:
+        """
+        Blocks until all the scheduled checkpoints are written
+        """
+        for future in self._pending:
+            future.result()
+        self._pending.clear()
+
+    def close(self) -> None:
+        self.wait()
+        self._executor.shutdown()
+
+    def restore(self) -> int:
+        """
+        Loads the weights and the optimizer state of the latest checkpoint.
+        Returns the epoch to continue from (0 if there is no checkpoint yet).
+        """
+        latest = self.manifest["latest"]
+        if latest is None:
+            return 0
+        self.recognizer.load_model(self.weights_path(latest["epoch"]), warm_up=False)
+        optimizer = self.recognizer.optimizer
+        optimizer.build(self.recognizer.trainable_variables)
+        with np.load(self.optimizer_path(latest["epoch"])) as saved:
+            values = [saved[f'arr_{i}'] for i in range(len(saved.files))]
+        if len(values) != len(optimizer.variables):
+            raise ValueError(
+                f'Optimizer state of epoch {latest["epoch"]} has {len(values)} variables, '
+                f'expected {len(optimizer.variables)}')
+        for variable, value in zip(optimizer.variables, values):
+            variable.assign(value)
+        return latest["epoch"] + 1
@@ -3,6 +3,7 @@
 from chessrec.app.app_main import ChessEvalApp
 from chessrec.models.board_detector_v0 import BoardDetector
 from chessrec.models.position_recognizer_v0 import PositionRecognizer
+from chessrec.numpy_inference import NumpyPositionRecognizer, IncrementalRecognizer
 
 import os
 import pkg_resources
@@ -34,14 +35,32 @@ parser.add_argument(
     default=os.path.join(default_weights_dir, "position_recognizer_v0.h5"), 
     type=str, 
     help="Path to recognizer weights")
+parser.add_argument(
+    "--recognizer_backend",
+    default="tensorflow",
+    choices=["tensorflow", "numpy"],
+    help="Recognizer inference backend, numpy skips building the tensorflow model (faster startup)")
+parser.add_argument(
+    "--incremental_threshold",
+    default=0.,
+    type=float,
+    help="If > 0, only the squares changed since the previous capture (by more than this many grey levels) "
+        "are recognized again (requires --recognizer_backend numpy)")
 
 def main() -> None:
     args = parser.parse_args([] if "__file__" not in globals() else None)
+    if args.incremental_threshold > 0 and args.recognizer_backend != "numpy":
+        parser.error("--incremental_threshold is implemented by the numpy backend, use --recognizer_backend numpy")
     detector = BoardDetector()
-    recognizer = PositionRecognizer()
-    
     detector.load_model(os.path.join(app_path, args.load_detector))
-    recognizer.load_model(os.path.join(app_path, args.load_recognizer))
+    if args.recognizer_backend == "numpy" and args.incremental_threshold > 0:
+        recognizer = IncrementalRecognizer(
+            NumpyPositionRecognizer(os.path.join(app_path, args.load_recognizer)), args.incremental_threshold)
+    elif args.recognizer_backend == "numpy":
+        recognizer = NumpyPositionRecognizer(os.path.join(app_path, args.load_recognizer))
+    else:
+        recognizer = PositionRecognizer()
+        recognizer.load_model(os.path.join(app_path, args.load_recognizer))
 
     root = tk.Tk()
     root.geometry(f'{args.master_W}x{args.master_H}')
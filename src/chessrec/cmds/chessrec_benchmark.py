@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import argparse
+import itertools
+import subprocess
+import sys
+import pkg_resources
+import multiprocessing as mp
+
+import numpy as np
+import cv2
+import tensorflow as tf
+
+import chessrec.fen_transcode as fen_transcode
+import chessrec.compositing as compositing
+from chessrec.asset_cache import add_alpha_channel
+from chessrec.models.position_recognizer_v0 import PositionRecognizer
+from chessrec.numpy_inference import NumpyPositionRecognizer, IncrementalRecognizer
+
+app_path = pkg_resources.resource_filename('chessrec', "")
+example_assets = os.path.join(app_path, "cmds", "generator_assets_example")
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("benchmark", choices=["compositing", "fen", "recognizer", "inference", "numpy_inference", "incremental"], help="Which benchmark to run")
+parser.add_argument("--repeats", default=200, type=int, help="Number of timed calls")
+parser.add_argument("--n_boards", default=100000, type=int, help="Number of boards for the batch benchmarks")
+parser.add_argument("--batch_size", default=32, type=int, help="Batch size of the training steps")
+parser.add_argument("--train_steps", default=20, type=int, help="Number of timed training steps")
+parser.add_argument("--first_call_runs", default=5, type=int, 
+    help="Number of fresh processes measuring the first inference call")
+parser.add_argument("--weights", 
+    default=pkg_resources.resource_filename('chessrec', os.path.join("models", "trained_weights", "position_recognizer_v0.h5")), 
+    type=str, help="Recognizer weights for the inference benchmark")
+parser.add_argument("--moves", default=50, type=int, help="Number of simulated captures of the incremental benchmark")
+parser.add_argument("--still_every", default=4, type=int, 
+    help="Every _th capture of the incremental benchmark shows the same position as the previous one")
+parser.add_argument("--piece_sets_path", default=os.path.join(example_assets, "chess_pieces"), type=str, help="Path to piece sets")
+parser.add_argument("--boards_imgs_path", default=os.path.join(example_assets, "chess_boards"), type=str, help="Path to boards")
+
+
+def timeit(fn, repeats: int) -> float:
+    """
+    Mean time of fn() in milliseconds
+    """
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def report(name: str, reference_ms: float, ms: float, max_diff: int | None = None) -> None:
+    diff = "" if max_diff is None else f', max abs diff {max_diff}'
+    print(f'{name:<40} {ms:8.3f} ms  ({reference_ms/ms:5.1f}x){diff}')
+
+
+def benchmark_compositing(args) -> None:
+    """
+    fen_transcode.overlay_png_images vs. the integer kernels in compositing
+    """
+    board_im = sorted(os.listdir(args.boards_imgs_path))[0]
+    board = add_alpha_channel(
+        cv2.imread(os.path.join(args.boards_imgs_path, board_im), cv2.IMREAD_COLOR))
+    square = board.shape[0] // 8
+    for pieces_set in sorted(os.listdir(args.piece_sets_path)):
+        pieces_path = os.path.join(args.piece_sets_path, pieces_set)
+        if not os.path.isdir(pieces_path):
+            continue
+        piece = cv2.imread(os.path.join(pieces_path, "wN.png"), cv2.IMREAD_UNCHANGED)
+        piece = cv2.resize(piece, (square, square))
+        sprite = compositing.PremultipliedSprite(piece)
+
+        reference = fen_transcode.overlay_png_images(board.copy(), piece, square, square)
+        premultiplied = sprite.blend(board.copy(), square, square)
+        max_diff = int(np.abs(reference.astype(np.int16) - premultiplied).max())
+
+        print(f'Piece {pieces_set}/wN.png {square}x{square} over {board_im}:')
+        target = board.copy()
+        reference_ms = timeit(
+            lambda: fen_transcode.overlay_png_images(target, piece, square, square), args.repeats)
+        report("  overlay_png_images (float64)", reference_ms, reference_ms)
+        report("  compositing.overlay_rgba", reference_ms, timeit(
+            lambda: compositing.overlay_rgba(target, piece, square, square), args.repeats))
+        report("  PremultipliedSprite.blend (uint16)", reference_ms, timeit(
+            lambda: sprite.blend(target, square, square), args.repeats), max_diff)
+
+    background = np.full([576, 1024, 4], 127, dtype=np.uint8)
+    small_board = cv2.resize(board, (512, 512))
+    print(f'Opaque board 512x512 over background 1024x576:')
+    reference_ms = timeit(
+        lambda: fen_transcode.overlay_png_images(background, small_board, 32, 32), args.repeats)
+    report("  overlay_png_images (float64)", reference_ms, reference_ms)
+    report("  compositing.overlay_rgba", reference_ms, timeit(
+        lambda: compositing.overlay_rgba(background, small_board, 32, 32), args.repeats))
+
+
+def random_encodings(n_boards: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    occupancy = rng.random([n_boards, 1, 1])
+    pieces = rng.integers(1, 13, size=[n_boards, 8, 8])
+    return (pieces * (rng.random([n_boards, 8, 8]) < occupancy)).astype(np.uint8)
+
+
+def benchmark_fen(args) -> None:
+    """
+    Per-board fen_transcode.encoding_to_FEN vs. the batch FEN codec
+    """
+    encodings = random_encodings(args.n_boards)
+    print(f'{args.n_boards} random boards:')
+
+    start = time.perf_counter()
+    reference = [fen_transcode.encoding_to_FEN(encoded_pos) for encoded_pos in encodings]
+    reference_s = time.perf_counter() - start
+    start = time.perf_counter()
+    fens = fen_transcode.encodings_to_fens(encodings)
+    batch_s = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = fen_transcode.fens_to_encodings(fens)
+    parse_s = time.perf_counter() - start
+
+    print(f'  encoding_to_FEN (per board)  {args.n_boards/reference_s:12.0f} boards/s')
+    print(f'  encodings_to_fens            {args.n_boards/batch_s:12.0f} boards/s  '
+          f'({reference_s/batch_s:5.1f}x), identical: {fens == reference}')
+    print(f'  fens_to_encodings            {args.n_boards/parse_s:12.0f} boards/s  '
+          f'round trip exact: {bool((parsed == encodings).all())}')
+
+
+def _recognizer_config(precision: str, jit_compile: bool, batch_size: int, train_steps: int, repeats: int) -> dict:
+    """
+    Training throughput and inference latency of one configuration. Runs in its own
+    process, as the dtype policy is global (and PositionRecognizer can be created only once).
+    """
+    PositionRecognizer.set_precision(precision)
+    recognizer = PositionRecognizer()
+    recognizer.compile(
+        optimizer=tf.keras.optimizers.AdamW(),
+        loss=tf.keras.losses.SparseCategoricalCrossentropy(),
+        jit_compile=jit_compile)
+    recognizer.set_jit_compile(jit_compile)
+
+    rng = np.random.default_rng(0)
+    images = rng.uniform(0, 255, [batch_size, 256, 256, 1]).astype(np.float32)
+    labels = rng.integers(0, 13, [batch_size, 8, 8]).astype(np.uint8)
+    # Compilation/tracing is not timed
+    recognizer.train_on_batch(images, labels)
+    start = time.perf_counter()
+    for _ in range(train_steps):
+        recognizer.train_on_batch(images, labels)
+    steps_per_s = train_steps / (time.perf_counter() - start)
+
+    image = images[:1]
+    recognizer.predict(image)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        recognizer.predict(image).numpy()
+        latencies.append(time.perf_counter() - start)
+    return {"steps_per_s": steps_per_s, "p50_ms": np.percentile(latencies, 50) * 1000}
+
+
+def benchmark_recognizer(args) -> None:
+    """
+    Training steps/s and single image inference latency of PositionRecognizer
+    for every combination of the precision and XLA compilation
+    """
+    print(f'PositionRecognizer, training batch {args.batch_size}, inference batch 1:')
+    ctx = mp.get_context("spawn")
+    reference = None
+    for precision, jit_compile in itertools.product(PositionRecognizer.PRECISIONS, [False, True]):
+        with ctx.Pool(1) as pool:
+            result = pool.apply(
+                _recognizer_config, 
+                (precision, jit_compile, args.batch_size, args.train_steps, args.repeats))
+        reference = reference or result
+        name = f'{precision}{" + XLA" if jit_compile else ""}'
+        print(f'  {name:<24} {result["steps_per_s"]:7.2f} steps/s '
+              f'({result["steps_per_s"]/reference["steps_per_s"]:4.2f}x)  '
+              f'inference {result["p50_ms"]:7.2f} ms '
+              f'({reference["p50_ms"]/result["p50_ms"]:4.2f}x)')
+
+
+def _inference_latencies(compiled: bool, weights: str, repeats: int) -> dict:
+    """
+    Latencies (in ms) of loading the model, of the first call and of the following
+    calls on a single image, in a fresh process
+    """
+    recognizer = PositionRecognizer()
+    image = np.random.default_rng(0).uniform(0, 255, [1, 256, 256, 1]).astype(np.float32)
+    if compiled:
+        predict = lambda: recognizer.predict_classes(image).numpy()
+    else:
+        predict = lambda: recognizer.predict(image)._numpy().astype(np.uint8)
+    start = time.perf_counter()
+    recognizer.load_model(weights, warm_up=compiled)
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    predict()
+    first = time.perf_counter() - start
+    steady = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict()
+        steady.append(time.perf_counter() - start)
+    return {"load_ms": load * 1000, "first_ms": first * 1000, "steady_ms": np.array(steady) * 1000}
+
+
+def benchmark_inference(args) -> None:
+    """
+    Single image latency of the eager RecognizerBase.predict vs. the compiled 
+    predict_classes (warmed up at load) - first call after loading the weights 
+    (over --first_call_runs fresh processes) and steady state (--repeats calls)
+    """
+    ctx = mp.get_context("spawn")
+    print(f'PositionRecognizer, batch 1, first call over {args.first_call_runs} processes, '
+          f'steady state over {args.repeats} calls:')
+    for name, compiled in [("predict (eager)", False), ("predict_classes (compiled)", True)]:
+        runs = []
+        for _ in range(args.first_call_runs):
+            with ctx.Pool(1) as pool:
+                runs.append(pool.apply(_inference_latencies, (compiled, args.weights, args.repeats)))
+        load = np.array([run["load_ms"] for run in runs])
+        first = np.array([run["first_ms"] for run in runs])
+        steady = np.concatenate([run["steady_ms"] for run in runs])
+        print(f'  {name:<28} load+warm-up p50 {np.percentile(load, 50):7.1f} ms | '
+              f'first call p50 {np.percentile(first, 50):7.2f} p99 {np.percentile(first, 99):7.2f} ms | '
+              f'steady p50 {np.percentile(steady, 50):6.2f} p99 {np.percentile(steady, 99):6.2f} ms')
+
+
+# Fresh interpreter: imports the backend, loads the weights and classifies one image
+_STARTUP_SCRIPT = {
+    "tensorflow": (
+        "import numpy as np\n"
+        "from chessrec.models.position_recognizer_v0 import PositionRecognizer\n"
+        "recognizer = PositionRecognizer()\n"
+        "recognizer.load_model({weights!r})\n"
+        "recognizer.predict_classes(np.zeros([1, 256, 256, 1], np.float32)).numpy()\n"),
+    "numpy": (
+        "import numpy as np\n"
+        "from chessrec.numpy_inference import NumpyPositionRecognizer\n"
+        "recognizer = NumpyPositionRecognizer({weights!r})\n"
+        "recognizer.predict_classes(np.zeros([1, 256, 256, 1], np.float32))\n"),
+}
+
+# Max abs difference of the probabilities of the numpy and the tensorflow recognizer
+PARITY_ATOL = 1e-5
+
+def benchmark_numpy_inference(args) -> None:
+    """
+    NumpyPositionRecognizer vs. PositionRecognizer - parity of the outputs on
+    random images (exits with an error on a mismatch), time from a fresh interpreter 
+    to the first classified image (over --first_call_runs processes) and steady 
+    state latency
+    """
+    images = np.random.default_rng(0).uniform(0, 255, [64, 256, 256, 1]).astype(np.float32)
+    recognizer = PositionRecognizer()
+    recognizer.load_model(args.weights)
+    numpy_recognizer = NumpyPositionRecognizer(args.weights)
+    probs = recognizer(images, training=False).numpy()
+    numpy_probs = numpy_recognizer(images)
+    classes = recognizer.predict_classes(images).numpy()
+    numpy_classes = numpy_recognizer.predict_classes(images)
+    print(f'Parity on {len(images)} images: max abs diff of the probabilities '
+          f'{np.abs(probs - numpy_probs).max():.2e}, same classes on '
+          f'{(classes == numpy_classes).mean():.2%} of the squares')
+    try:
+        np.testing.assert_allclose(numpy_probs, probs, rtol=0, atol=PARITY_ATOL)
+        np.testing.assert_array_equal(numpy_classes, classes)
+    except AssertionError as error:
+        sys.exit(f'NumpyPositionRecognizer does not match PositionRecognizer:{error}')
+
+    print(f'Startup to the first classified image, over {args.first_call_runs} processes:')
+    for backend, script in _STARTUP_SCRIPT.items():
+        times = []
+        for _ in range(args.first_call_runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", script.format(weights=args.weights)], check=True)
+            times.append(time.perf_counter() - start)
+        print(f'  {backend:<12} p50 {np.percentile(times, 50):6.2f} s')
+
+    image = images[:1]
+    reference = timeit(lambda: recognizer.predict_classes(image).numpy(), args.repeats)
+    print(f'Batch 1, steady state over {args.repeats} calls:')
+    report("PositionRecognizer.predict_classes", reference, reference)
+    report("NumpyPositionRecognizer.predict_classes", reference, 
+        timeit(lambda: numpy_recognizer.predict_classes(image), args.repeats))
+
+
+def simulated_game(n_captures: int, still_every: int, seed: int = 0) -> list[np.ndarray]:
+    """
+    Captures (1,256,256,1) of a random position changed by one random piece move 
+    per capture, except every still_every-th capture, which repeats the previous one
+    """
+    rng = np.random.default_rng(seed)
+    renderer = fen_transcode.PositionRenderer()
+    encoded = random_encodings(1, seed)[0]
+    captures = []
+    for i in range(n_captures):
+        pieces = np.argwhere(encoded > 0)
+        if i % still_every != still_every - 1 and len(pieces):
+            source = tuple(pieces[rng.integers(len(pieces))])
+            target = tuple(rng.integers(0, 8, 2))
+            if source != target:
+                encoded[target], encoded[source] = encoded[source], 0
+        image = cv2.cvtColor(renderer.render(encoded), cv2.COLOR_BGRA2GRAY)
+        captures.append(cv2.resize(image, (256, 256))[None, ..., None].astype(np.float32))
+    return captures
+
+
+def benchmark_incremental(args) -> None:
+    """
+    Per-capture latency of the IncrementalRecognizer vs. full NumpyPositionRecognizer 
+    recognitions on a simulated game, with the number of squares they disagree on
+    """
+    captures = simulated_game(args.moves, args.still_every)
+    recognizer = NumpyPositionRecognizer(args.weights)
+    incremental = IncrementalRecognizer(recognizer)
+    full_times, incremental_times, still_times = [], [], []
+    disagreements = 0
+    for i, capture in enumerate(captures):
+        start = time.perf_counter()
+        full = recognizer.predict_classes(capture)
+        full_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        classes = incremental.predict_classes(capture)
+        incremental_times.append(time.perf_counter() - start)
+        if i % args.still_every == args.still_every - 1:
+            still_times.append(incremental_times[-1])
+        disagreements += int((full != classes).sum())
+    full_ms = np.mean(full_times) * 1000
+    stats = incremental.stats()
+    print(f'{args.moves} captures, one move per capture, unchanged every {args.still_every}th:')
+    report("full recognition", full_ms, full_ms)
+    report("incremental recognition", full_ms, np.mean(incremental_times) * 1000)
+    report("incremental, unchanged capture", full_ms, np.mean(still_times) * 1000)
+    print(f'Recomputed {stats["recomputed_tiles"]} tiles, {stats["computed_fraction"]:.1%} of the full '
+          f'computation, {disagreements} squares differ from the full recognition')
+
+
+BENCHMARKS = {
+    "compositing": benchmark_compositing,
+    "fen": benchmark_fen,
+    "recognizer": benchmark_recognizer,
+    "inference": benchmark_inference,
+    "numpy_inference": benchmark_numpy_inference,
+    "incremental": benchmark_incremental,
+}
+
+def main() -> None:
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ import argparse
 import pkg_resources
 
 from chessrec.data_generator import ChessBoardGenerator
+from chessrec.dataset_io import write_sharded_dataset, export_memmap_dataset
 app_path = pkg_resources.resource_filename('chessrec', "")
 example_assets = os.path.join(app_path, "cmds", "generator_assets_example")
 
@@ -17,6 +18,15 @@ parser.add_argument("--only_boards", default=True, type=bool,
 parser.add_argument("--piece_sets_path", default=os.path.join(example_assets, "chess_pieces"), type=str, help="Path to piece sets")
 parser.add_argument("--boards_imgs_path", default=os.path.join(example_assets, "chess_boards"), type=str, help="Path to boards")
 parser.add_argument("--background_im_path", default=os.path.join(example_assets, "backgrounds"), type=str, help="Path to background images")
+parser.add_argument("--format", default="tf", choices=["tf", "npy"], 
+    help="tf: tf.data.Dataset.save, npy: flat .npy arrays that can be memory-mapped (not sharded)")
+parser.add_argument("--shard_size", default=0, type=int, 
+    help="If > 0, the dataset is saved in shards of this size, listed in a manifest; "
+         "re-running the command skips already complete shards")
+parser.add_argument("--workers", default=1, type=int, help="Number of processes writing the shards")
+parser.add_argument("--seed", default=0, type=int, help="Base seed of the shards")
+parser.add_argument("--render_batch_size", default=0, type=int, 
+    help="If > 0, shards are rendered with the batched ChessBoardGenerator.generate_batch")
 
 
 def main() -> None:
@@ -24,9 +34,25 @@ def main() -> None:
     generator =  ChessBoardGenerator(
             args.boards_imgs_path, 
             args.piece_sets_path,
-            args.background_im_path).tfGenerator(only_boards=args.only_boards)
-    data = generator.take(args.dataset_size)
-    data.save(args.save_path)
+            args.background_im_path)
+    if args.shard_size > 0 and args.format == "npy":
+        parser.error("--format npy does not support --shard_size")
+    if args.shard_size > 0:
+        write_sharded_dataset(
+            generator,
+            args.save_path,
+            args.dataset_size,
+            args.shard_size,
+            workers=args.workers,
+            seed=args.seed,
+            only_boards=args.only_boards,
+            render_batch_size=args.render_batch_size)
+        return
+    data = generator.tfGenerator(only_boards=args.only_boards).take(args.dataset_size)
+    if args.format == "npy":
+        export_memmap_dataset(data, args.save_path, args.dataset_size)
+    else:
+        data.save(args.save_path)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import argparse
+import pkg_resources
+
+import numpy as np
+import tensorflow as tf
+
+from chessrec.data_generator import ChessBoardGenerator
+from chessrec.dataset_io import render_arrays
+from chessrec.models.position_recognizer_v0 import PositionRecognizer
+from chessrec.quantization import export_int8, QuantizedRecognizer
+from chessrec.cmds.chessrec_train_recognizer import validation_image
+
+
+app_path = pkg_resources.resource_filename('chessrec', "")
+example_assets = os.path.join(app_path, "cmds", "generator_assets_example")
+default_weights_dir = os.path.join(app_path, "models", "trained_weights")
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--load_recognizer", default=os.path.join(default_weights_dir, "position_recognizer_v0.h5"),
+    type=str, help="Path to the float recognizer weights")
+parser.add_argument("--save_quantized", default="position_recognizer_v0_int8.tflite", type=str,
+    help="Path to save the int8 TFLite model")
+parser.add_argument("--representative_size", default=200, type=int,
+    help="Number of generated samples calibrating the quantization")
+parser.add_argument("--val_dataset_size", default=1000, type=int,
+    help="Number of generated samples comparing the float and the quantized model")
+parser.add_argument("--seed", default=0, type=int,
+    help="Seed of the representative samples (the validation set uses seed + 1)")
+parser.add_argument("--threads", default=1, type=int, help="Number of threads of both models")
+parser.add_argument("--repeats", default=200, type=int, help="Number of timed single image calls")
+parser.add_argument("--piece_sets_path", default=os.path.join(example_assets, "chess_pieces"), type=str, help="Path to piece sets")
+parser.add_argument("--boards_imgs_path", default=os.path.join(example_assets, "chess_boards"), type=str, help="Path to boards")
+parser.add_argument("--background_im_path", default=os.path.join(example_assets, "backgrounds"), type=str, help="Path to background images")
+
+
+def generated_images(generator: ChessBoardGenerator, n_samples: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fixed set of n_samples recognizer inputs (N,256,256,1) and their (N,8,8) labels
+    """
+    img, label, _ = render_arrays(generator, n_samples, seed)
+    return validation_image(img).numpy(), label
+
+
+def accuracies(predict, images: np.ndarray, labels: np.ndarray, batch_size: int = 64) -> tuple[float, float]:
+    """
+    Square and board accuracy of predict (images -> (B,8,8) classes)
+    """
+    predicted = np.concatenate([
+        np.asarray(predict(images[i:i + batch_size])) for i in range(0, len(images), batch_size)])
+    correct = predicted == labels
+    return float(correct.mean()), float(correct.all(axis=(1, 2)).mean())
+
+
+def latency_ms(predict, image: np.ndarray, repeats: int) -> tuple[float, float]:
+    """
+    p50 and p99 single image latency in milliseconds
+    """
+    predict(image)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(image)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return float(np.percentile(times, 50)), float(np.percentile(times, 99))
+
+
+def main() -> None:
+    args = parser.parse_args([] if "__file__" not in globals() else None)
+    tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+    tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+
+    generator = ChessBoardGenerator(
+            args.boards_imgs_path,
+            args.piece_sets_path,
+            args.background_im_path)
+    representative, _ = generated_images(generator, args.representative_size, args.seed)
+    val_images, val_labels = generated_images(generator, args.val_dataset_size, args.seed + 1)
+
+    recognizer = PositionRecognizer()
+    recognizer.load_model(args.load_recognizer)
+    start = time.perf_counter()
+    size = export_int8(recognizer, representative, args.save_quantized)
+    print(f'Int8 model saved to {args.save_quantized} in {time.perf_counter() - start:.1f}s')
+    quantized = QuantizedRecognizer(args.save_quantized, num_threads=args.threads)
+
+    float_predict = lambda images: recognizer.predict_classes(images).numpy()
+    float_size = os.path.getsize(args.load_recognizer)
+    float_square, float_board = accuracies(float_predict, val_images, val_labels)
+    int8_square, int8_board = accuracies(quantized.predict_classes, val_images, val_labels)
+    float_p50, float_p99 = latency_ms(float_predict, val_images[:1], args.repeats)
+    int8_p50, int8_p99 = latency_ms(quantized.predict_classes, val_images[:1], args.repeats)
+
+    print(f'{"":<8} {"size":>10} {"p50":>9} {"p99":>9} {"square acc":>11} {"board acc":>10}  '
+          f'(batch 1, {args.threads} threads, {args.val_dataset_size} validation samples)')
+    print(f'{"float":<8} {float_size/1024:7.0f} kB {float_p50:6.2f} ms {float_p99:6.2f} ms '
+          f'{float_square:11.4f} {float_board:10.4f}')
+    print(f'{"int8":<8} {size/1024:7.0f} kB {int8_p50:6.2f} ms {int8_p99:6.2f} ms '
+          f'{int8_square:11.4f} {int8_board:10.4f}')
+    print(f'{"delta":<8} {size/float_size:9.2f}x {float_p50/int8_p50:8.2f}x {"":>9} '
+          f'{int8_square - float_square:+11.4f} {int8_board - float_board:+10.4f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import pkg_resources
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+
+import numpy as np
+import cv2
+
+import chessrec.fen_transcode as fen_transcode
+
+
+app_path = pkg_resources.resource_filename('chessrec', "")
+default_weights_dir = os.path.join(app_path, "models", "trained_weights")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp", ".tif", ".tiff")
+INPUT_SIZE = 256
+
+
+parser = argparse.ArgumentParser(
+    description="Recognizes the positions on chessboard images, one output line (path, FEN) per image")
+parser.add_argument("inputs", nargs="*", default=["-"],
+    help='Image files, directories or glob patterns; "-" (default) reads the image paths from stdin, one per line')
+parser.add_argument("--load_recognizer", default=os.path.join(default_weights_dir, "position_recognizer_v0.h5"),
+    type=str, help="Path to recognizer weights")
+parser.add_argument("--recognizer_backend", default="tensorflow", choices=["tensorflow", "numpy"],
+    help="Recognizer inference backend (see chessrec_app)")
+parser.add_argument("--batch_size", default=32, type=int, help="Number of images recognized at once")
+parser.add_argument("--workers", default=max(1, (os.cpu_count() or 2) - 1), type=int,
+    help="Number of processes decoding and resizing the images")
+parser.add_argument("--prefetch_batches", default=2, type=int,
+    help="Number of batches decoded ahead of the recognizer (bounds the memory use)")
+parser.add_argument("--format", default="jsonl", choices=["jsonl", "csv"], help="Output format")
+parser.add_argument("--output", default="-", type=str, help='Output file, "-" for stdout')
+parser.add_argument("--black_perspective", default=False, action="store_true",
+    help="Boards are seen from the black side (flipped before the FEN is written, as in the app)")
+parser.add_argument("--threads", default=0, type=int, help="Tensorflow threads, 0 lets tensorflow decide")
+
+
+def iter_paths(inputs: list[str]):
+    """
+    Lazily lists the image paths of the inputs - files, directories (their images,
+    sorted, not recursive), glob patterns or "-" for the paths given on stdin
+    """
+    for item in inputs:
+        if item == "-":
+            for line in sys.stdin:
+                if line.strip():
+                    yield line.strip()
+        elif os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(item, name)
+        elif glob.has_magic(item):
+            yield from sorted(glob.iglob(item, recursive=True))
+        else:
+            yield item
+
+
+def load_image(path: str) -> np.ndarray:
+    """
+    Grey-scale image resized to the (256,256) recognizer input, as uint8
+    (to keep the transfer from the worker processes small)
+    """
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f'Cannot decode image {path}')
+    return cv2.resize(image, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def decoded_batches(paths, batch_size: int, pool: ProcessPoolExecutor, max_pending: int):
+    """
+    Batches (paths, images, errors) of the decoded images, in the input order.
+    At most max_pending images are submitted to the pool at once, so the decoding
+    runs ahead of the consumer while the memory stays bounded.
+    """
+    pending: deque[tuple[str, Future]] = deque()
+    paths = iter(paths)
+
+    def refill() -> None:
+        while len(pending) < max_pending:
+            path = next(paths, None)
+            if path is None:
+                return
+            pending.append((path, pool.submit(load_image, path)))
+
+    refill()
+    while pending:
+        batch_paths, images, errors = [], [], []
+        while pending and len(batch_paths) < batch_size:
+            path, future = pending.popleft()
+            # The freed slot is taken right away, the decoding continues during the inference
+            refill()
+            batch_paths.append(path)
+            try:
+                images.append(future.result())
+                errors.append(None)
+            except Exception as error:
+                images.append(None)
+                errors.append(str(error))
+        yield batch_paths, images, errors
+
+
+def create_recognizer(args):
+    """
+    Recognizer with predict_classes((B,256,256,1) float32) -> (B,8,8) classes.
+    Imported here, so the decoding workers (and the numpy backend) do not import tensorflow.
+    """
+    load_path = os.path.abspath(args.load_recognizer)
+    if args.recognizer_backend == "numpy":
+        from chessrec.numpy_inference import NumpyPositionRecognizer
+        return NumpyPositionRecognizer(load_path)
+    import tensorflow as tf
+    from chessrec.models.position_recognizer_v0 import PositionRecognizer
+    if args.threads:
+        tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    recognizer = PositionRecognizer()
+    recognizer.load_model(load_path)
+    return recognizer
+
+
+def recognize_batch(recognizer, images: list, black_perspective: bool) -> list[str | None]:
+    """
+    FENs (piece placement part) of the decoded images, None for the failed ones
+    """
+    decoded = [image for image in images if image is not None]
+    if not decoded:
+        return [None] * len(images)
+    inputs = np.stack(decoded)[..., None].astype(np.float32)
+    encoded = np.asarray(recognizer.predict_classes(inputs))
+    if black_perspective:
+        encoded = np.flip(encoded, axis=(1, 2))
+    fens = iter(fen_transcode.encodings_to_fens(encoded))
+    return [None if image is None else next(fens) for image in images]
+
+
+class RecordWriter():
+    """
+    Writes one line per image (path, fen, error) as JSON lines or CSV, flushed after every batch
+    """
+    FIELDS = ["path", "fen", "error"]
+
+    def __init__(self, stream, output_format: str) -> None:
+        self.stream = stream
+        self.format = output_format
+        if output_format == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=self.FIELDS)
+            self._csv.writeheader()
+
+    def write(self, records: list[dict]) -> None:
+        for record in records:
+            if self.format == "csv":
+                self._csv.writerow(record)
+            else:
+                self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
+
+
+def main() -> None:
+    args = parser.parse_args([] if "__file__" not in globals() else None)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    writer = RecordWriter(out, args.format)
+    # Workers started before the recognizer is built - they only decode with cv2
+    pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=mp.get_context("spawn"))
+    try:
+        recognizer = create_recognizer(args)
+        n_images, n_failed = 0, 0
+        start = time.perf_counter()
+        for paths, images, errors in decoded_batches(
+                iter_paths(args.inputs), args.batch_size, pool, args.batch_size * args.prefetch_batches):
+            fens = recognize_batch(recognizer, images, args.black_perspective)
+            writer.write([
+                {"path": path, "fen": fen, "error": error}
+                    for path, fen, error in zip(paths, fens, errors)])
+            n_images += len(paths)
+            n_failed += sum(error is not None for error in errors)
+        elapsed = time.perf_counter() - start
+        print(f'Recognized {n_images - n_failed} images ({n_failed} failed) in {elapsed:.1f}s, '
+              f'{n_images / elapsed if elapsed else 0:.1f} images/s', file=sys.stderr)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import json
+import time
+import argparse
+import functools
+import itertools
+import pkg_resources
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import tensorflow as tf
+from tensorflow.keras import optimizers
+
+from chessrec.data_generator import ChessBoardGenerator
+from chessrec.dataset_io import cached_generated_path, load_memmap_dataset
+from chessrec.models.position_recognizer_v0 import PositionRecognizer
+from chessrec.cmds.chessrec_train_recognizer import (
+    train_preprocess, validation_preprocess, preprocessed, recognizer_compile)
+
+
+app_path = pkg_resources.resource_filename('chessrec', "")
+example_assets = os.path.join(app_path, "cmds", "generator_assets_example")
+
+# Swept parameters and their defaults (same as in chessrec_train_recognizer)
+PARAMETERS = {
+    "batch_size": 128,
+    "learning_rate": 0.001,
+    "weight_decay": 0.004,
+    "max_brightness_delta": 0.4,
+    "min_contrast": 0.5,
+    "max_contrast": 1.5,
+    "gauss_noise_prob": 0.1,
+    "gauss_noise_var": 0.6,
+}
+AUGMENTATION_PARAMETERS = [
+    "max_brightness_delta", "min_contrast", "max_contrast", "gauss_noise_prob", "gauss_noise_var"]
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--grid", default='{"batch_size": [64, 128], "max_brightness_delta": [0.2, 0.4]}', type=str,
+    help=f'JSON dict (or path to a JSON file) of the swept parameters and their values, parameters: {list(PARAMETERS)}')
+parser.add_argument("--dataset_dir", default="sweep_data", type=str,
+    help="Directory of the shared pre-rendered datasets, keyed by the generator settings, size and seed")
+parser.add_argument("--dataset_size", default=10000, type=int, help="Number of training samples")
+parser.add_argument("--val_dataset_size", default=2000, type=int, help="Number of validation samples")
+parser.add_argument("--seed", default=0, type=int, help="Seed of the rendered datasets and of the runs")
+parser.add_argument("--epochs", default=5, type=int, help="Epochs (passes over the shared dataset) of every run")
+parser.add_argument("--parallel", default=2, type=int, help="Number of runs training at once")
+parser.add_argument("--threads_per_run", default=1, type=int, help="Tensorflow threads of every run")
+parser.add_argument("--leaderboard", default="sweep_leaderboard.csv", type=str, help="Path to save the leaderboard")
+parser.add_argument("--save_dir", default="", type=str, help="If set, the weights of every run are saved there")
+parser.add_argument("--piece_sets_path", default=os.path.join(example_assets, "chess_pieces"), type=str, help="Path to piece sets")
+parser.add_argument("--boards_imgs_path", default=os.path.join(example_assets, "chess_boards"), type=str, help="Path to boards")
+parser.add_argument("--background_im_path", default=os.path.join(example_assets, "backgrounds"), type=str, help="Path to background images")
+
+
+def grid_configs(grid: dict[str, list]) -> list[dict]:
+    """
+    All the combinations of the grid values, missing parameters get their defaults
+    """
+    unknown = set(grid) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters {sorted(unknown)}, use some of {list(PARAMETERS)}')
+    names = sorted(grid)
+    return [
+        {**PARAMETERS, **dict(zip(names, values))}
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _init_run_process(threads: int) -> None:
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+
+
+def run_config(
+        index: int,
+        config: dict,
+        train_path: str,
+        val_path: str,
+        epochs: int,
+        seed: int,
+        save_dir: str) -> dict:
+    """
+    Trains a new recognizer with the given config on the shared memory-mapped
+    dataset, returns the config together with its final metrics
+    """
+    tf.keras.utils.set_random_seed(seed + index)
+    batch_size = config["batch_size"]
+    augmentation = {name: config[name] for name in AUGMENTATION_PARAMETERS}
+    dataset_train = preprocessed(
+        load_memmap_dataset(train_path, batch_size, shuffle=True, seed=seed + index),
+        functools.partial(train_preprocess, sparse_labels=True, **augmentation))
+    dataset_val = preprocessed(
+        load_memmap_dataset(val_path, batch_size),
+        functools.partial(validation_preprocess, sparse_labels=True))
+
+    recognizer = PositionRecognizer()
+    recognizer_compile(
+        argparse.Namespace(sparse_labels=True, jit_compile=False),
+        recognizer,
+        optimizers.AdamW(learning_rate=config["learning_rate"], weight_decay=config["weight_decay"]))
+    start = time.perf_counter()
+    history = recognizer.fit(dataset_train, epochs=epochs, validation_data=dataset_val, verbose=0)
+    train_time = time.perf_counter() - start
+    if save_dir:
+        recognizer.save_model(os.path.join(save_dir, f'run_{index}.h5'))
+    return {
+        "run": index,
+        **config,
+        "val_board_accuracy": history.history["val_Boad accuracy"][-1],
+        "val_square_accuracy": history.history["val_Square accuracy"][-1],
+        "val_loss": history.history["val_loss"][-1],
+        "train_time_s": train_time,
+    }
+
+
+def write_leaderboard(path: str, results: list[dict]) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main() -> None:
+    args = parser.parse_args([] if "__file__" not in globals() else None)
+    grid = args.grid
+    if os.path.isfile(grid):
+        with open(grid) as f:
+            grid = f.read()
+    try:
+        configs = grid_configs(json.loads(grid))
+    except ValueError as error:
+        parser.error(str(error))
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    generator = ChessBoardGenerator(
+            args.boards_imgs_path,
+            args.piece_sets_path,
+            args.background_im_path)
+    start = time.perf_counter()
+    train_path = cached_generated_path(generator, args.dataset_dir, args.dataset_size, args.seed)
+    val_path = cached_generated_path(generator, args.dataset_dir, args.val_dataset_size, args.seed + 1)
+    print(f'Shared datasets ready in {time.perf_counter() - start:.1f}s: {train_path}, {val_path}')
+
+    # Spawned processes, each used for a single run (a PositionRecognizer can be created
+    # only once per process), all mapping the same dataset files
+    results = []
+    with ProcessPoolExecutor(
+            max_workers=args.parallel,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_run_process,
+            initargs=(args.threads_per_run,),
+            max_tasks_per_child=1) as pool:
+        futures = [
+            pool.submit(
+                run_config, index, config, train_path, val_path,
+                args.epochs, args.seed, args.save_dir)
+            for index, config in enumerate(configs)]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f'Run {result["run"]} ({len(results)}/{len(configs)}): '
+                  f'board accuracy {result["val_board_accuracy"]:.4f}, '
+                  f'loss {result["val_loss"]:.4f}, {result["train_time_s"]:.0f}s')
+
+    results.sort(key=lambda result: (-result["val_board_accuracy"], result["val_loss"]))
+    write_leaderboard(args.leaderboard, results)
+    print("Leaderboard:")
+    swept = sorted(json.loads(grid))
+    for place, result in enumerate(results, 1):
+        params = ", ".join(f'{name}={result[name]}' for name in swept)
+        print(f'{place:3d}. board accuracy {result["val_board_accuracy"]:.4f}  '
+              f'loss {result["val_loss"]:.4f}  {params}')
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import json
+import time
+import socket
+import subprocess
 import pkg_resources
 import argparse
+import functools
 
 import numpy as np 
 import tensorflow as tf
@@ -10,7 +16,11 @@ from tensorflow.keras import losses, metrics, optimizers
 import cv2
 
 from chessrec.data_generator import ChessBoardGenerator as CBgen
-from chessrec.models.metrics import BoardAccuracy, IoU
+from chessrec.dataset_io import load_dataset, render_arrays, cached_generated_dataset
+from chessrec.replay_buffer import ReplayBuffer, HardExampleBuffer
+from chessrec.checkpoints import CheckpointManager
+from chessrec.telemetry import PipelineTelemetry
+from chessrec.models.metrics import BoardAccuracy, SparseBoardAccuracy, SparseSquareAccuracy, IoU
 from chessrec.models.position_recognizer_v0 import PositionRecognizer
 import chessrec.constants as consts
 
@@ -25,15 +35,51 @@ parser.add_argument("--boards_imgs_path", default=os.path.join(example_assets, "
 parser.add_argument("--background_im_path", default=os.path.join(example_assets, "backgrounds"), type=str, help="Path to background images")
 
 parser.add_argument("--threads", default=1, type=int, help="NUmber of threads to use during training")
+parser.add_argument("--generator_workers", default=0, type=int, 
+    help="Number of processes rendering the training data; if 0, data are rendered in the training process")
+parser.add_argument("--seed", default=0, type=int, help="Base seed of the data generator workers")
 parser.add_argument("--load_recognizer", default='', type=str, help="Path to pretrained weights")
 parser.add_argument("--save_recognizer", default="trained_recognizer", type=str, help="Path to save the weights")
+parser.add_argument("--keep_best", default=0, type=int, 
+    help="If > 0, keeps only the best N checkpoints (by validation board accuracy) and the latest one")
+parser.add_argument("--resume", default=False, action="store_true", 
+    help="Continue from the latest checkpoint of --save_recognizer (weights and optimizer state)")
 parser.add_argument("--load_val_dataset", default="", type=str, 
     help="Load some fixed validation dataset; if empty, validation dataset will not be fixed during training")
+parser.add_argument("--val_cache", default="", choices=["", "ram", "disk"], 
+    help="Render the validation set once and keep it in RAM or in --val_cache_dir (otherwise regenerated every epoch)")
+parser.add_argument("--val_cache_dir", default="val_cache", type=str, 
+    help="Directory of the on-disk validation sets, keyed by the generator settings, size and seed")
 parser.add_argument("--val_dataset_size", default=2000, type=int, help="")
 parser.add_argument("--train_batches_per_epoch", default=100, type=int, help="")
 parser.add_argument("--train_data_update_period", default=20, type=int, 
     help="Every _th epoch, generator generates new train dataset")
 parser.add_argument("--batch_size", default=128, type=int, help="")
+parser.add_argument("--batched_rendering", default=False, action="store_true", 
+    help="Render whole batches at once (ChessBoardGenerator.generate_batch)")
+parser.add_argument("--sparse_labels", default=False, action="store_true", 
+    help="Keep the labels as uint8 class indices (sparse cross-entropy and integer metrics) instead of one-hot")
+parser.add_argument("--precision", default="float32", choices=PositionRecognizer.PRECISIONS, 
+    help="Keras dtype policy, mixed_bfloat16 computes in bfloat16 with float32 weights and softmax")
+parser.add_argument("--jit_compile", default=False, action="store_true", 
+    help="XLA compile the training step")
+parser.add_argument("--replay_buffer_size", default=0, type=int, 
+    help="If > 0, train from a pool of this many pre-rendered samples, refreshed in the background")
+parser.add_argument("--replay_refresh_fraction", default=0.25, type=float, 
+    help="Fraction of the replay buffer replaced by fresh samples every epoch")
+parser.add_argument("--hard_examples", default=0, type=int, 
+    help="If > 0, keeps up to this many misclassified training samples and mixes them back into the batches")
+parser.add_argument("--hard_replay_ratio", default=0.25, type=float, 
+    help="Part of every training batch replaced by the hard examples")
+parser.add_argument("--hard_mining_batches", default=4, type=int, 
+    help="Number of the last training batches searched for the hard examples after every epoch")
+parser.add_argument("--target_board_accuracy", default=0., type=float, 
+    help="If > 0, stops once the validation board accuracy reaches it and reports the number of rendered samples")
+parser.add_argument("--telemetry_log", default="", type=str, 
+    help="Per-epoch input pipeline telemetry (samples/s, step time, input wait, generator stage times) "
+         "appended to this .csv or .json file. Generator stages are timed only if it runs in-process (--generator_workers 0)")
+parser.add_argument("--num_workers", default=1, type=int, 
+    help="If > 1, trains data-parallel in this many local worker processes (MultiWorkerMirroredStrategy)")
 parser.add_argument("--epochs", default=1000, type=int, help="")
 
 # preprocessing constants
@@ -43,71 +89,350 @@ MAX_CONTRAST = 1.5
 GAUSS_NOISE_PROB = 0.1
 GAUSS_NOISE_VAR = 0.6
 
-def train_preprocess(img, label, bbox):
-    label = tf.one_hot(label, consts.SQUARE_CLASSES)
+def encode_label(label, sparse_labels: bool = False):
+    """
+    Label of the (B,8,8) class indices either one-hot encoded, 
+    or kept as uint8 indices for the sparse loss and metrics
+    """
+    if sparse_labels:
+        return tf.cast(label, tf.uint8)
+    return tf.one_hot(label, consts.SQUARE_CLASSES)
+
+def train_preprocess(
+        img, 
+        label, 
+        bbox, 
+        sparse_labels: bool = False,
+        max_brightness_delta: float = MAX_BRIGHTNESS_DELTA,
+        min_contrast: float = MIN_CONTRAST,
+        max_contrast: float = MAX_CONTRAST,
+        gauss_noise_prob: float = GAUSS_NOISE_PROB,
+        gauss_noise_var: float = GAUSS_NOISE_VAR):
+    """
+    Augmentation of a whole batch (B,H,W,3) - contrast, brightness and the 
+    decision about the Gaussian noise are random per sample, all inside the graph.
+    The augmentation constants can be overridden, e.g. by chessrec_sweep.
+    """
+    label = encode_label(label, sparse_labels)
     img = tf.image.rgb_to_grayscale(img)
-    img = tf.image.random_contrast(img, MIN_CONTRAST, MAX_CONTRAST)
-    img = tf.image.random_brightness(img, max_delta=MAX_BRIGHTNESS_DELTA)
-    img = tf.cast(img, tf.float32)
-    if tf.random.uniform([], minval=0, maxval=1) > 1-GAUSS_NOISE_PROB:
-        img = tf.keras.layers.GaussianNoise(GAUSS_NOISE_VAR)(img, training=True)
+    img = tf.image.convert_image_dtype(img, tf.float32)
+    per_sample = tf.stack([tf.shape(img)[0], 1, 1, 1])
+
+    contrast = tf.random.uniform(per_sample, min_contrast, max_contrast)
+    mean = tf.reduce_mean(img, axis=[1, 2], keepdims=True)
+    img = tf.clip_by_value((img - mean) * contrast + mean, 0., 1.)
+    brightness = tf.random.uniform(per_sample, -max_brightness_delta, max_brightness_delta)
+    img = tf.clip_by_value(img + brightness, 0., 1.) * 255.
+
+    add_noise = tf.random.uniform(per_sample) > 1-gauss_noise_prob
+    noise = tf.random.normal(tf.shape(img), stddev=gauss_noise_var)
+    img = img + noise * tf.cast(add_noise, tf.float32)
     return img, label, bbox
 
-def validation_preprocess(img, label, bbox):
-    label = tf.one_hot(label, consts.SQUARE_CLASSES)
+def validation_image(img):
     img = tf.image.rgb_to_grayscale(img)
-    img = tf.cast(img, tf.float32)
-    return img, label, bbox
+    return tf.cast(img, tf.float32)
 
-def fit_recognizer(args, recognizer):
-    data_generator = CBgen(
-            args.boards_imgs_path, 
-            args.piece_sets_path,
-            args.background_im_path).tfGenerator(only_boards=True)
-    train_generator = data_generator.map(train_preprocess).map(lambda x,y,z: (x,y))
-    val_generator = data_generator.map(validation_preprocess).map(lambda x,y,z: (x,y))
+def validation_preprocess(img, label, bbox, sparse_labels: bool = False):
+    label = encode_label(label, sparse_labels)
+    return validation_image(img), label, bbox
 
-    if args.load_val_dataset:
-        dataset_val = tf.data.Dataset.load(args.load_val_dataset)
+# Independent generated data streams derived from the same seed (see stream_seed),
+# the main one (batched_data, used also by the non-fixed validation) is 0
+REPLAY_STREAM = 1
+HARD_EXAMPLES_STREAM = 2
+
+def stream_seed(seed: int, stream: int) -> int:
+    """
+    Seed of one of the generated data streams - generators with the same seed 
+    (e.g. two ParallelChessBoardGenerators) would render the same samples
+    """
+    return int(np.random.SeedSequence([seed, stream]).generate_state(1)[0])
+
+def batched_data(args, generator: CBgen) -> tf.data.Dataset:
+    """
+    Batches of raw generated samples - rendered either sample by sample, 
+    or (with --batched_rendering) as whole batches
+    """
+    render_batch_size = args.batch_size if args.batched_rendering else None
+    data_generator = generator.tfGenerator(
+        only_boards=True, 
+        batch_size=render_batch_size,
+        workers=args.generator_workers, 
+        seed=args.train_seed)
+    if render_batch_size:
+        return data_generator
+    return data_generator.batch(args.batch_size)
+
+def replay_buffer(args, generator: CBgen, chief: bool = True) -> ReplayBuffer:
+    """
+    Replay buffer filled (and refreshed in the background) from the generator
+    """
+    source = generator.python_generator(
+        only_boards=True, 
+        batch_size=args.batch_size if args.batched_rendering else None,
+        workers=args.generator_workers, 
+        seed=stream_seed(args.train_seed, REPLAY_STREAM))
+    buffer = ReplayBuffer(
+        source, args.replay_buffer_size, args.replay_refresh_fraction, seed=args.train_seed)
+    fill_time = buffer.fill()
+    if chief:
+        print(f'Replay buffer of {args.replay_buffer_size} samples filled in {fill_time:.1f}s')
+    return buffer
+
+def materialized_validation(args, generator: CBgen, chief: bool = True) -> tf.data.Dataset:
+    """
+    Validation set rendered only once (seeded by the base --seed, so it is
+    the same for all the workers) and kept either in RAM or in the on-disk cache
+    """
+    start = time.perf_counter()
+    if args.val_cache == "ram":
+        dataset_val = tf.data.Dataset.from_tensor_slices(
+            render_arrays(generator, args.val_dataset_size, args.seed)).batch(args.batch_size)
     else:
-        dataset_val = val_generator.take(args.val_dataset_size).batch(args.batch_size) 
-    
-    for epoch in range(args.epochs):
-        print(f'EPOCH: {epoch}')
-        if epoch % args.train_data_update_period == 0:
-            dataset_train = train_generator.batch(args.batch_size)
-            dataset_train = dataset_train.take(args.train_batches_per_epoch)
-        
-        recognizer.fit(dataset_train,
-            epochs=1,
-            verbose='auto',
-            validation_data = dataset_val,
-            steps_per_epoch = args.train_batches_per_epoch,
-        )
-        if args.save_recognizer: 
-            recognizer.save_model(f'{args.save_recognizer}_{epoch}.h5')
+        dataset_val = cached_generated_dataset(
+            generator, args.val_cache_dir, args.val_dataset_size, args.seed, args.batch_size)
+    dataset_val = dataset_val.map(
+        functools.partial(validation_preprocess, sparse_labels=args.sparse_labels))
+    dataset_val = dataset_val.map(lambda x,y,z: (x,y)).cache()
+    if chief:
+        print(f'Validation set of {args.val_dataset_size} samples materialized '
+              f'({args.val_cache}) in {time.perf_counter() - start:.1f}s')
+    return dataset_val
 
-def main():
-    args = parser.parse_args([] if "__file__" not in globals() else None)
-    tf.config.threading.set_inter_op_parallelism_threads(args.threads)
-    tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+def preprocessed(dataset: tf.data.Dataset, preprocess) -> tf.data.Dataset:
+    """
+    Parallel preprocessing of the batches, prefetched ahead of the training step
+    """
+    dataset = dataset.map(preprocess, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.map(lambda x,y,z: (x,y))
+    return dataset.prefetch(tf.data.AUTOTUNE)
 
-    pos_recognizer = PositionRecognizer()
-    if args.load_recognizer != "": 
-        pos_recognizer.load_model(args.load_recognizer)
-        print(f'Recognizer loaded')
+def local_cluster(num_workers: int) -> list[str]:
+    """
+    Addresses (with free ports) of the local worker processes
+    """
+    sockets = [socket.socket() for _ in range(num_workers)]
+    for sock in sockets:
+        sock.bind(("localhost", 0))
+    addresses = [f'localhost:{sock.getsockname()[1]}' for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return addresses
 
+def launch_local_workers(args) -> int:
+    """
+    Runs this script in args.num_workers processes, each with its own TF_CONFIG.
+    Worker 0 is the chief. Returns the first non-zero exit code (0 on success).
+    """
+    cluster = local_cluster(args.num_workers)
+    workers = []
+    for index in range(args.num_workers):
+        tf_config = {"cluster": {"worker": cluster}, "task": {"type": "worker", "index": index}}
+        env = dict(os.environ, TF_CONFIG=json.dumps(tf_config))
+        workers.append(subprocess.Popen(
+            [sys.executable, "-m", "chessrec.cmds.chessrec_train_recognizer", *sys.argv[1:]], env=env))
+    exit_code = 0
+    try:
+        while any(worker.poll() is None for worker in workers):
+            failed = [worker.returncode for worker in workers if worker.returncode]
+            if failed:
+                # The other workers would wait for the failed one forever
+                exit_code = failed[0]
+                break
+            time.sleep(1)
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+            worker.wait()
+    return exit_code or next((worker.returncode for worker in workers if worker.returncode), 0)
 
-    pos_recognizer.compile(
-        optimizer=optimizers.AdamW(),
-        loss=losses.CategoricalCrossentropy(),
-        metrics=[
+def distribution_strategy() -> tuple[tf.distribute.Strategy, int]:
+    """
+    MultiWorkerMirroredStrategy if running as one of the workers (TF_CONFIG set),
+    otherwise the default strategy. Returns also the task index (0 for the chief).
+    """
+    if "TF_CONFIG" not in os.environ:
+        return tf.distribute.get_strategy(), 0
+    task_index = json.loads(os.environ["TF_CONFIG"])["task"]["index"]
+    return tf.distribute.MultiWorkerMirroredStrategy(), task_index
+
+def without_autoshard(dataset: tf.data.Dataset) -> tf.data.Dataset:
+    """
+    Every worker renders its own data, so the datasets are not sharded between the workers
+    """
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options)
+
+def rendered_samples(
+        args, 
+        epochs: int, 
+        buffer: ReplayBuffer | None, 
+        hard_examples: HardExampleBuffer | None) -> int:
+    """
+    Number of training samples rendered so far - pulled from the generator
+    by the input pipeline (possibly including some prefetched ones)
+    """
+    if buffer is not None:
+        return buffer.pool_size + buffer.refreshes * buffer.refresh_size
+    if hard_examples is not None:
+        return hard_examples.fresh
+    return epochs * args.train_batches_per_epoch * args.batch_size
+
+def fit_recognizer(
+        args, 
+        recognizer, 
+        chief: bool = True, 
+        checkpoints: CheckpointManager | None = None,
+        start_epoch: int = 0):
+    generator = CBgen(
+            args.boards_imgs_path, 
+            args.piece_sets_path,
+            args.background_im_path)
+    data_generator = batched_data(args, generator)
+    train_preprocess_fn = functools.partial(train_preprocess, sparse_labels=args.sparse_labels)
+    validation_preprocess_fn = functools.partial(validation_preprocess, sparse_labels=args.sparse_labels)
+    val_generator = preprocessed(data_generator, validation_preprocess_fn)
+    telemetry = None
+    if args.telemetry_log and chief:
+        profiler = generator.enable_profiling() if args.generator_workers == 0 else None
+        telemetry = PipelineTelemetry(
+            args.batch_size, args.telemetry_log, profiler, CBgen.PROFILED_STAGES)
+    # Validation set materialized before the replay producer starts drawing from the generator
+    # (the seeded rendering uses the process-global random state)
+    if args.load_val_dataset:
+        dataset_val = load_dataset(args.load_val_dataset)
+        if len(dataset_val.element_spec) == 3:
+            # Raw generated samples (image, label, bbox), e.g. from chessrec_generate_data
+            dataset_val = preprocessed(dataset_val.batch(args.batch_size), validation_preprocess_fn)
+    elif args.val_cache:
+        dataset_val = materialized_validation(args, generator, chief)
+    else:
+        dataset_val = val_generator.take(-(-args.val_dataset_size // args.batch_size))
+    dataset_val = without_autoshard(dataset_val)
+    buffer, hard_examples = None, None
+    if args.replay_buffer_size:
+        buffer = replay_buffer(args, generator, chief)
+        train_data = buffer.dataset(args.batch_size)
+        buffer.start()
+    else:
+        train_data = data_generator
+    if args.hard_examples:
+        hard_examples = HardExampleBuffer(
+            args.hard_examples, args.hard_replay_ratio, args.hard_mining_batches, seed=args.train_seed)
+        if buffer is not None:
+            source = lambda: buffer.batches(args.batch_size)
+        else:
+            source = generator.python_generator(
+                only_boards=True, 
+                batch_size=args.batch_size if args.batched_rendering else None,
+                workers=args.generator_workers, 
+                seed=stream_seed(args.train_seed, HARD_EXAMPLES_STREAM))
+        train_data = hard_examples.dataset(
+            source, args.batch_size, (generator.out_board_H, generator.out_board_W, generator.COL_CHANNELS))
+    train_generator = preprocessed(train_data, train_preprocess_fn)
+    if telemetry is not None:
+        train_generator = telemetry.mark_dataset(train_generator)
+
+    try:
+        for epoch in range(start_epoch, args.epochs):
+            if chief:
+                print(f'EPOCH: {epoch}')
+            if buffer is not None and epoch > start_epoch:
+                waited = buffer.refresh()
+                if chief:
+                    print(f'Replay buffer: {buffer.refresh_size} samples replaced, waited {waited:.2f}s')
+            if epoch == start_epoch or epoch % args.train_data_update_period == 0 or buffer is not None:
+                dataset_train = without_autoshard(train_generator.take(args.train_batches_per_epoch))
+            
+            if telemetry is not None:
+                telemetry.epoch_offset = epoch
+            history = recognizer.fit(dataset_train,
+                epochs=1,
+                verbose='auto' if chief else 0,
+                validation_data = dataset_val,
+                steps_per_epoch = args.train_batches_per_epoch,
+                callbacks = [telemetry] if telemetry is not None else None,
+            )
+            logs = {name: values[-1] for name, values in history.history.items()}
+            if checkpoints is not None and chief: 
+                checkpoints.save(epoch, logs)
+            if hard_examples is not None:
+                added = hard_examples.mine(lambda img: recognizer.predict_classes(validation_image(img)))
+                if chief:
+                    print(f'Hard examples: {added} new, {hard_examples.stats()}')
+            if args.target_board_accuracy and logs.get("val_Boad accuracy", 0.) >= args.target_board_accuracy:
+                if chief:
+                    print(f'Target board accuracy {args.target_board_accuracy} reached after epoch {epoch}, '
+                          f'rendered training samples: {rendered_samples(args, epoch - start_epoch + 1, buffer, hard_examples)}')
+                break
+    finally:
+        if checkpoints is not None:
+            checkpoints.close()
+        if buffer is not None:
+            buffer.stop()
+            if chief:
+                print(f'Replay buffer: {buffer.stats()}')
+
+def recognizer_compile(args, pos_recognizer, optimizer: optimizers.Optimizer | None = None) -> None:
+    """
+    Loss and metrics for the one-hot or sparse labels, AdamW with the default 
+    parameters unless the optimizer is given
+    """
+    if args.sparse_labels:
+        loss = losses.SparseCategoricalCrossentropy()
+        recognizer_metrics = [
+            SparseSquareAccuracy(name="Square accuracy"), 
+            SparseBoardAccuracy(name="Boad accuracy")
+        ]
+    else:
+        loss = losses.CategoricalCrossentropy()
+        recognizer_metrics = [
             metrics.CategoricalAccuracy(name="Square accuracy"), 
             BoardAccuracy(name="Boad accuracy")
         ]
+    pos_recognizer.compile(
+        optimizer=optimizer or optimizers.AdamW(),
+        loss=loss,
+        metrics=recognizer_metrics,
+        jit_compile=args.jit_compile
     )
-    pos_recognizer.summary()
-    fit_recognizer(args, pos_recognizer)
+
+def main():
+    args = parser.parse_args([] if "__file__" not in globals() else None)
+    if args.num_workers > 1 and "TF_CONFIG" not in os.environ:
+        sys.exit(launch_local_workers(args))
+    tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+    tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    strategy, task_index = distribution_strategy()
+    chief = task_index == 0
+    # Own training data seed stream of every worker (--batch_size stays the global batch size),
+    # the validation set is seeded by the base --seed, so all the workers evaluate the same one
+    args.train_seed = args.seed
+    if strategy.num_replicas_in_sync > 1:
+        args.train_seed = int(np.random.SeedSequence([args.seed, task_index]).generate_state(1)[0])
+
+    PositionRecognizer.set_precision(args.precision)
+    with strategy.scope():
+        pos_recognizer = PositionRecognizer()
+        if args.load_recognizer != "": 
+            pos_recognizer.load_model(args.load_recognizer, warm_up=False)
+            if chief:
+                print(f'Recognizer loaded')
+        recognizer_compile(args, pos_recognizer)
+        checkpoints, start_epoch = None, 0
+        if args.save_recognizer:
+            checkpoints = CheckpointManager(
+                pos_recognizer, args.save_recognizer, args.keep_best, resume=args.resume)
+            if args.resume:
+                start_epoch = checkpoints.restore()
+                if chief:
+                    print(f'Resuming from epoch {start_epoch}')
+    if chief:
+        pos_recognizer.summary()
+    fit_recognizer(args, pos_recognizer, chief, checkpoints, start_epoch)
 
 if __name__ == '__main__':
   main()
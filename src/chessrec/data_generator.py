@@ -1,11 +1,20 @@
 import os
 import random
+import queue
+import weakref
+import threading
+import contextlib
+import multiprocessing as mp
+from collections import deque
 import numpy as np
 import tensorflow as tf
 import cv2
 
 import chessrec.constants as const
 import chessrec.fen_transcode as fen_transcode
+import chessrec.compositing as compositing
+from chessrec.profiling import StageProfiler
+from chessrec.asset_cache import SpriteAtlas, BackgroundCache, add_alpha_channel
 
 class ChessBoardGenerator():
     """
@@ -20,6 +29,12 @@ class ChessBoardGenerator():
     HARD_OFFSET: float = 1/16
 
     IMAGE_SUPP_FORMATS = [".jpg", ".png"]
+    # Methods timed by self.enable_profiling()
+    PROFILED_STAGES = [
+        "_sample_pieces", "_sample_positions", "_generate_board_and_encoding", 
+        "_get_background", "_create_board", "_crop_and_resize",
+        "_sample_labels_batch", "_render_boards_batch", "_sample_crops_batch", "generate_batch"]
+
     def __init__(self, 
               boards_imgs_path: str = '', 
               piece_sets_path: str = '',
@@ -27,19 +42,33 @@ class ChessBoardGenerator():
               out_board_H: int = 256, 
               out_board_W: int = 256,
               output_min_size: int = 96,
-              output_max_size: int = 512) -> None:
+              output_max_size: int = 512,
+              sprite_memory_budget: int = SpriteAtlas.DEFAULT_MEMORY_BUDGET,
+              background_memory_budget: int = BackgroundCache.DEFAULT_MEMORY_BUDGET) -> None:
+
+        # Arguments needed to recreate the generator in the worker processes
+        self._init_kwargs = dict(
+            boards_imgs_path=boards_imgs_path,
+            piece_sets_path=piece_sets_path,
+            background_im_path=background_im_path,
+            out_board_H=out_board_H,
+            out_board_W=out_board_W,
+            output_min_size=output_min_size,
+            output_max_size=output_max_size,
+            sprite_memory_budget=sprite_memory_budget,
+            background_memory_budget=background_memory_budget)
 
-        # Setting assets path
+        # Setting assets path (sorted, so the seeded streams do not depend on the file system order)
         self.piece_sets_path = piece_sets_path
-        self.pieces_sets = [os.path.join(piece_sets_path, f) 
+        self.pieces_sets = sorted(os.path.join(piece_sets_path, f) 
                                 for f in os.listdir(piece_sets_path) 
-                                  if os.path.isdir(os.path.join(piece_sets_path, f))]
-        self.boards = [os.path.join(boards_imgs_path, img) 
+                                  if os.path.isdir(os.path.join(piece_sets_path, f)))
+        self.boards = sorted(os.path.join(boards_imgs_path, img) 
                           for img in os.listdir(boards_imgs_path) 
-                            if os.path.splitext(img)[-1].lower() in self.IMAGE_SUPP_FORMATS]
-        self.backgrounds = [os.path.join(background_im_path, img) 
+                            if os.path.splitext(img)[-1].lower() in self.IMAGE_SUPP_FORMATS)
+        self.backgrounds = sorted(os.path.join(background_im_path, img) 
                                for img in os.listdir(background_im_path) 
-                                  if os.path.splitext(img)[-1].lower() in self.IMAGE_SUPP_FORMATS]
+                                  if os.path.splitext(img)[-1].lower() in self.IMAGE_SUPP_FORMATS)
 
         # formating sizes of the output images
         self.output_min_size = output_min_size
@@ -53,6 +82,27 @@ class ChessBoardGenerator():
         self._coordinates = np.array(coordinates).T.reshape([-1,2])
         # Switch whether to generate only boards or not
         self._only_boards = True
+        # Decoded and pre-resized boards and pieces, filled lazily
+        self.sprite_atlas = SpriteAtlas(sprite_memory_budget)
+        # Decoded and resized backgrounds, filled lazily
+        self.background_cache = BackgroundCache(
+            self.BACKGROUND_H, self.BACKGROUND_W, background_memory_budget)
+        # Stage timers, see self.enable_profiling()
+        self.profiler: StageProfiler | None = None
+
+    def enable_profiling(self, window: int = 10000) -> StageProfiler:
+        """
+        Starts timing the self.PROFILED_STAGES; results are in self.profiler
+        (self.profiler.summary() or self.profiler.to_json()). Without calling this, 
+        the generator runs the plain methods with no overhead.
+        """
+        self.profiler = StageProfiler(window)
+        self.profiler.instrument(self, self.PROFILED_STAGES)
+        return self.profiler
+
+    def disable_profiling(self) -> None:
+        StageProfiler.uninstrument(self, self.PROFILED_STAGES)
+        self.profiler = None
 
     def _pieces_probs(self, n_pieces_on_board: int) -> np.ndarray:
         """
@@ -98,12 +148,19 @@ class ChessBoardGenerator():
                                     replace=False)
         return self._coordinates[pos_coordinates]
 
-    @staticmethod
-    def add_alpha_channel(img):
-        if img.shape[2] < 4:
-          alpha_ch = np.ones_like(img[...,0], dtype=np.uint8)*255
-          img = np.concatenate([img, alpha_ch[...,None]], axis=-1)
-        return img
+    add_alpha_channel = staticmethod(add_alpha_channel)
+
+    def warm_up_sprites(self) -> None:
+        """
+        Preloads all the board/piece set combinations into self.sprite_atlas
+        """
+        self.sprite_atlas.warm_up(self.pieces_sets, self.boards)
+
+    def warm_up_backgrounds(self) -> None:
+        """
+        Preloads backgrounds into self.background_cache (as many as fit the budget)
+        """
+        self.background_cache.warm_up(self.backgrounds)
 
     def _generate_board_and_encoding( 
             self, 
@@ -114,18 +171,16 @@ class ChessBoardGenerator():
         """
         pieces = self._sample_pieces()
         pos_coordinates = self._sample_positions(pieces)
-        position_image = cv2.imread(board_im, cv2.IMREAD_COLOR)
-        position_image = self.add_alpha_channel(position_image)
+        sprites = self.sprite_atlas.get(pieces_set, board_im)
+        position_image = sprites["board"].copy()
         position_encoding = np.zeros(
                       [const.BOARD_RANKS, const.BOARD_FILES], dtype=np.int32)
 
         for piece_pos, piece in zip(pos_coordinates, pieces):
             rank, file = piece_pos 
-            piece_image = os.path.join(pieces_set, f'{piece}.png')
-            piece_image = cv2.imread(piece_image, cv2.IMREAD_UNCHANGED)
-            position_image = fen_transcode.place_piece_on_board(
+            position_image = fen_transcode.place_sprite_on_board(
                                 position_image, 
-                                piece_image, 
+                                sprites[piece], 
                                 file, 
                                 rank)
             position_encoding[rank, file] = const.PIECES_ENCODING[piece]
@@ -134,12 +189,13 @@ class ChessBoardGenerator():
         position_image = cv2.resize(position_image, (out_dim, out_dim))
         return position_image, position_encoding
 
-    def _get_background(self):
+    def _get_background(self) -> np.ndarray:
+        """
+        Random background from self.background_cache. The frame is shared 
+        and read-only, see _create_board.
+        """
         background_img = random.choice(self.backgrounds)
-        image = cv2.imread(background_img, cv2.IMREAD_COLOR)
-        image = self.add_alpha_channel(image)
-        image = cv2.resize(image, (self.BACKGROUND_W, self.BACKGROUND_H))
-        return image
+        return self.background_cache.get(background_img)
 
 
     def _get_crop_offsets(self, backgr, board, board_y_offset, board_x_offset):
@@ -177,11 +233,6 @@ class ChessBoardGenerator():
         board_y_offset = random.randint(0, (backgr.shape[0]-board.shape[0]))
         board_x_offset = random.randint(0, (backgr.shape[1]-board.shape[1]))
 
-        image = fen_transcode.overlay_png_images(
-            backgr, board, 
-            board_y_offset, 
-            board_x_offset)
-
         y_off, x_off, h_add, w_add = self._get_crop_offsets(
             backgr, 
             board, 
@@ -199,10 +250,19 @@ class ChessBoardGenerator():
         t_h = np.log(board.shape[0]/h_crop)
         t_w = np.log(board.shape[1]/w_crop)
 
-        crop_img = image[y_crop:y_crop+h_crop, x_crop:x_crop+w_crop]
-        crop_img = cv2.resize(crop_img, (self.out_board_W, self.out_board_H))
+        # The background may be a shared cached frame - only the crop 
+        # (which always contains the whole board) is copied and drawn on
+        crop_img = backgr[y_crop:y_crop+h_crop, x_crop:x_crop+w_crop].copy()
+        crop_img = compositing.overlay_rgba(
+            crop_img, board, 
+            board_y_offset - y_crop, 
+            board_x_offset - x_crop)
+        crop_img = self._crop_and_resize(crop_img)
         return crop_img, (t_y, t_x, t_h, t_w)
 
+    def _crop_and_resize(self, crop_img: np.ndarray) -> np.ndarray:
+        return cv2.resize(crop_img, (self.out_board_W, self.out_board_H))
+
     def _generator(self):
         """
         Python generator returning random chessboards with background
@@ -222,17 +282,391 @@ class ChessBoardGenerator():
             board_with_backgroud = board_with_backgroud[...,:-1]
             yield (board_with_backgroud, label, bounding_box)
 
-    def tfGenerator(self, only_boards: bool = True) -> tf.data.Dataset:
+    def _sample_labels_batch(self, n: int) -> np.ndarray:
         """
-        Creates the tensorflow dataset generator, using the python 
-        generator self._generator()
+        Vectorized version of _sample_pieces + _sample_positions for n boards.
+        Returns (n, 8, 8) encodings already in the "human-natural" orientation, 
+        i.e. row 0 is the top row of the image.
+        """
+        n_pieces_on_board = np.random.randint(
+                              low = 1, 
+                              high = const.NUMBER_OF_PIECES +1,
+                              size = n)
+        # Random permutation of squares per board, first n_pieces_on_board are occupied
+        squares_order = np.argsort(np.random.random([n, const.N_SQUARES]), axis=1)
+        squares_rank = np.argsort(squares_order, axis=1)
+        occupied = squares_rank < n_pieces_on_board[:,None]
+
+        # Piece types sampled by inverse CDF of self._pieces_probs
+        piece_type_probs = {
+            n_pieces: self._pieces_probs(n_pieces) for n_pieces in np.unique(n_pieces_on_board)}
+        piece_type_cdf = np.stack(
+            [np.cumsum(piece_type_probs[n_pieces]) for n_pieces in n_pieces_on_board])
+        uniform = np.random.random([n, const.N_SQUARES])
+        piece_types = (uniform[...,None] > piece_type_cdf[:,None,:]).sum(axis=-1)
+        piece_types = np.minimum(piece_types, len(const.PIECE_TYPES) - 1)
+        players = np.random.randint(0, len(const.PLAYERS), size=[n, const.N_SQUARES])
+
+        codes_lut = np.array([[const.PIECES_ENCODING[f'{player}{piece}'] 
+                                  for piece in const.PIECE_TYPES] 
+                                    for player in const.PLAYERS], dtype=np.int32)
+        labels = np.where(occupied, codes_lut[players, piece_types], 0)
+        return labels.reshape([n, const.BOARD_RANKS, const.BOARD_FILES]).astype(np.int32)
+
+    @staticmethod
+    def _render_boards_batch(
+            labels: np.ndarray,
+            boards: np.ndarray,
+            sprites: np.ndarray) -> np.ndarray:
+        """
+        Composites the piece sprites (n, SQUARE_CLASSES, S, S, 4) over the 
+        boards (n, 8*S, 8*S, 3) according to the labels (n, 8, 8). The boards
+        are modified in place; only the occupied squares are blended.
+        """
+        n, square_size = labels.shape[0], sprites.shape[-2]
+        squares = boards.reshape(
+            [n, const.BOARD_RANKS, square_size, const.BOARD_FILES, square_size, 3])
+        board_idx, rank_idx, file_idx = np.nonzero(labels)
+        # Advanced indices separated by slices -> shape (n_pieces, S, S, C)
+        board_squares = squares[board_idx, rank_idx, :, file_idx].astype(np.uint16)
+        piece_sprites = sprites[board_idx, labels[board_idx, rank_idx, file_idx]]
+        alpha = piece_sprites[...,3:].astype(np.uint16)
+        blended = piece_sprites[...,:3] * alpha + board_squares * (255 - alpha) + 127
+        squares[board_idx, rank_idx, :, file_idx] = (blended // 255).astype(np.uint8)
+        return boards
+
+    def _sample_crops_batch(self, n: int) -> dict[str, np.ndarray]:
+        """
+        Vectorized version of the random geometry in _create_board and _get_crop_offsets. 
+        All the values are in the background coordinates.
+        """
+        board_size = np.random.randint(self.output_min_size, self.output_max_size + 1, size=n)
+        board_y = np.random.randint(0, self.BACKGROUND_H - board_size + 1)
+        board_x = np.random.randint(0, self.BACKGROUND_W - board_size + 1)
+        if self._only_boards:
+            hard_or_ezy_switch = np.random.randint(0, 2, size=n)
+            max_offset = np.where(hard_or_ezy_switch == 0, self.EZY_OFFSET, self.HARD_OFFSET)
+            max_offset = np.round(max_offset*board_size).astype(np.int64)
+            y_off = np.random.randint(0, max_offset + 1)
+            x_off = np.random.randint(0, max_offset + 1)
+            h_add = y_off + np.random.randint(0, max_offset + 1)
+            w_add = x_off + np.random.randint(0, max_offset + 1)
+        else:
+            y_off = np.random.randint(0, board_y + 1)
+            x_off = np.random.randint(0, board_x + 1)
+            h_add = y_off + np.random.randint(0, self.BACKGROUND_H - board_size - board_y + 1)
+            w_add = x_off + np.random.randint(0, self.BACKGROUND_W - board_size - board_x + 1)
+
+        y_crop = np.maximum(0, board_y - y_off)
+        x_crop = np.maximum(0, board_x - x_off)
+        h_crop = board_size + h_add
+        w_crop = board_size + w_add
+        bounding_box = np.stack([
+            y_off/h_crop - 1/2,
+            x_off/w_crop - 1/2,
+            np.log(board_size/h_crop),
+            np.log(board_size/w_crop)], axis=-1).astype(np.float32)
+        return {
+            "board_size": board_size, "board_y": board_y, "board_x": board_x,
+            "y_crop": y_crop, "x_crop": x_crop,
+            # The crop is clipped by the background edges, as the slicing in _create_board
+            "h_crop": np.minimum(h_crop, self.BACKGROUND_H - y_crop),
+            "w_crop": np.minimum(w_crop, self.BACKGROUND_W - x_crop),
+            "bounding_box": bounding_box}
+
+    def generate_batch(
+            self, 
+            n: int, 
+            square_size: int | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Batched counterpart of self._generator(). Labels, pieces compositing and crop
+        geometry of all the n samples are computed at once with numpy operations. 
+        Boards are rendered with square_size pixels per square (by default just 
+        enough for the output resolution) and then resampled directly into 
+        the output crop, so the random board size only decides the board/background 
+        proportions. Backgrounds are loaded only for the samples where they are visible.
+        Returns (n, H, W, 3) uint8 images, (n, 8, 8) int32 labels and (n, 4) float32 bounding boxes.
+        """
+        if square_size is None:
+            square_size = -(-max(self.out_board_H, self.out_board_W) // const.BOARD_FILES)
+        assets = self.sprite_atlas.stacked(self.pieces_sets, self.boards, square_size)
+        board_size_rendered = square_size * const.BOARD_FILES
+
+        labels = self._sample_labels_batch(n)
+        boards_idx = np.random.randint(0, len(self.boards), size=n)
+        pieces_idx = np.random.randint(0, len(self.pieces_sets), size=n)
+        boards = self._render_boards_batch(
+            labels, assets["boards"][boards_idx], assets["sprites"][pieces_idx])
+
+        # Output pixel centers mapped to the background and to the rendered board
+        geometry = self._sample_crops_batch(n)
+        out_y = (np.arange(self.out_board_H) + 0.5) / self.out_board_H
+        out_x = (np.arange(self.out_board_W) + 0.5) / self.out_board_W
+        backgr_y = geometry["y_crop"][:,None] + out_y[None,:]*geometry["h_crop"][:,None] - 0.5
+        backgr_x = geometry["x_crop"][:,None] + out_x[None,:]*geometry["w_crop"][:,None] - 0.5
+        board_scale = (board_size_rendered / geometry["board_size"])[:,None]
+        board_y = (backgr_y - geometry["board_y"][:,None] + 0.5) * board_scale - 0.5
+        board_x = (backgr_x - geometry["board_x"][:,None] + 0.5) * board_scale - 0.5
+        with_edges = ((board_y < -0.5) | (board_y > board_size_rendered - 0.5)).any(axis=1) | \
+                     ((board_x < -0.5) | (board_x > board_size_rendered - 0.5)).any(axis=1)
+        backgrounds_idx = np.random.randint(0, len(self.backgrounds), size=n)
+
+        # The maps are separable (axis-aligned crop + scale), the bilinear resampling 
+        # itself is done by cv2.remap, the boards are pasted over the background 
+        # (only where visible) with the transparent border mode
+        images = np.empty(
+            [n, self.out_board_H, self.out_board_W, self.COL_CHANNELS], dtype=np.uint8)
+        maps_shape = (self.out_board_H, self.out_board_W)
+        as_map = lambda coord, axis: np.broadcast_to(
+            np.expand_dims(coord.astype(np.float32), axis), maps_shape).copy()
+        for i in range(n):
+            if with_edges[i]:
+                backgr = self.background_cache.get(self.backgrounds[backgrounds_idx[i]])
+                images[i] = cv2.remap(
+                    backgr, 
+                    as_map(backgr_x[i], 0), as_map(backgr_y[i], 1), 
+                    cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)[...,:self.COL_CHANNELS]
+            cv2.remap(
+                boards[i], 
+                as_map(board_x[i], 0), as_map(board_y[i], 1), 
+                cv2.INTER_LINEAR, dst=images[i], 
+                borderMode=cv2.BORDER_TRANSPARENT if with_edges[i] else cv2.BORDER_REPLICATE)
+        return images, labels, geometry["bounding_box"]
+
+    def _batch_generator(self, batch_size: int):
+        """
+        Python generator returning batches of random chessboards from self.generate_batch()
+        """
+        while True:
+            yield self.generate_batch(batch_size)
+
+    def python_generator(
+            self, 
+            only_boards: bool = True, 
+            batch_size: int | None = None,
+            workers: int = 0,
+            seed: int = 0):
+        """
+        Returns the python generator function behind self.tfGenerator() - single 
+        samples from self._generator(), or whole batches if batch_size is given.
+        With workers > 0, the data are rendered by a ParallelChessBoardGenerator
+        process pool seeded from the seed.
         """
         self._only_boards = only_boards
+        if workers > 0:
+            return ParallelChessBoardGenerator(
+                self._init_kwargs, 
+                workers, 
+                base_seed=seed, 
+                batch_size=batch_size, 
+                only_boards=only_boards)
+        if batch_size:
+            return lambda: self._batch_generator(batch_size)
+        return self._generator
+
+    def tfGenerator(
+            self, 
+            only_boards: bool = True, 
+            batch_size: int | None = None,
+            workers: int = 0,
+            seed: int = 0) -> tf.data.Dataset:
+        """
+        Creates the tensorflow dataset generator, using the python 
+        generator from self.python_generator(). If batch_size is given, the dataset 
+        yields whole batches rendered by self.generate_batch().
+        """
+        python_generator = self.python_generator(only_boards, batch_size, workers, seed)
+
+        if batch_size:
+            return tf.data.Dataset.from_generator(
+            python_generator, 
+              output_types=(tf.uint8, tf.int32, tf.float32), 
+              output_shapes=([batch_size, self.out_board_H, self.out_board_W, self.COL_CHANNELS], 
+                              [batch_size, const.BOARD_RANKS, const.BOARD_FILES], 
+                              [batch_size, 4])
+            )
         data_generator = tf.data.Dataset.from_generator(
-        self._generator, 
+        python_generator, 
           output_types=(tf.uint8, tf.int32, tf.float32), 
           output_shapes=([self.out_board_W, self.out_board_H, self.COL_CHANNELS], 
                           [const.BOARD_RANKS, const.BOARD_FILES], 
                           [4])
         )
-        return data_generator
\ No newline at end of file
+        return data_generator
+
+
+def seed_everything(seed: int) -> None:
+    """
+    Seeds both the random generators used by ChessBoardGenerator
+    """
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+@contextlib.contextmanager
+def seeded(seed: int):
+    """
+    Seeds the generator's random generators for the duration of the block
+    and restores their previous state afterwards. These are the process-global
+    np.random/random states - the block must not run while other threads draw
+    from them (e.g. a started ReplayBuffer producer), otherwise it is not reproducible.
+    """
+    np_state, py_state = np.random.get_state(), random.getstate()
+    seed_everything(seed)
+    try:
+        yield
+    finally:
+        np.random.set_state(np_state)
+        random.setstate(py_state)
+
+
+def _generation_worker(
+        generator_kwargs: dict,
+        only_boards: bool,
+        batch_size: int | None,
+        chunk_size: int,
+        seed: int,
+        out_queue: mp.Queue,
+        stop_event) -> None:
+    """
+    Worker process of ParallelChessBoardGenerator. Renders batches (or chunks of 
+    single samples) into its own queue until the stop_event is set.
+    """
+    # One process per core, do not oversubscribe with the cv2 threads
+    cv2.setNumThreads(1)
+    seed_everything(seed)
+    generator = ChessBoardGenerator(**generator_kwargs)
+    generator._only_boards = only_boards
+    samples = generator._generator()
+    while not stop_event.is_set():
+        if batch_size:
+            item = generator.generate_batch(batch_size)
+        else:
+            chunk = [next(samples) for _ in range(chunk_size)]
+            item = tuple(np.stack(tensors) for tensors in zip(*chunk))
+        while not stop_event.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+    # Unsent items can be dropped, the consumer is not interested anymore
+    out_queue.cancel_join_thread()
+
+
+def _stop_generation_workers(stop_event, queues: list, processes: list) -> None:
+    stop_event.set()
+    for out_queue in queues:
+        out_queue.cancel_join_thread()
+    for process in processes:
+        process.join(timeout=1)
+        if process.is_alive():
+            process.terminate()
+
+
+class ParallelChessBoardGenerator():
+    """
+    Process pool of ChessBoardGenerators. Each worker renders with its own seed 
+    spawned from the base_seed and fills its own bounded queue. The queues are 
+    drained in round-robin order, so a given (base_seed, workers) always 
+    reproduces the same stream.
+    The pool is started by the first call and lives until close() (or until the 
+    instance is garbage collected). Every call continues the same stream, so 
+    re-iterating the tf dataset does not replay the same data and does not pay 
+    for starting new workers each epoch.
+    Workers are not forked from the calling process by default - the pool is usually 
+    started from a tf.data thread of the multithreaded tensorflow runtime, which is 
+    not safe to fork. They are forked by a single-threaded fork server instead, which 
+    imports this module once, so the workers do not pay for the imports again.
+    """
+    def __init__(
+            self,
+            generator_kwargs: dict,
+            workers: int,
+            base_seed: int = 0,
+            batch_size: int | None = None,
+            only_boards: bool = True,
+            chunk_size: int = 16,
+            queue_size: int = 4,
+            start_method: str = "forkserver") -> None:
+        self.generator_kwargs = generator_kwargs
+        self.workers = workers
+        self.base_seed = base_seed
+        self.batch_size = batch_size
+        self.only_boards = only_boards
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.start_method = start_method
+        self._lock = threading.Lock()
+        self._processes = None
+        self._queues = None
+        self._finalizer = None
+        self._next_worker = 0
+        # Samples of a partially consumed chunk, continued by the next item
+        self._pending = deque()
+
+    def worker_seeds(self) -> list[int]:
+        seed_sequence = np.random.SeedSequence(self.base_seed)
+        return [int(child.generate_state(1)[0]) for child in seed_sequence.spawn(self.workers)]
+
+    def _start(self) -> None:
+        ctx = mp.get_context(self.start_method)
+        if self.start_method == "forkserver":
+            # Imported once by the server process, the workers forked from it start right away
+            ctx.set_forkserver_preload([__name__])
+        stop_event = ctx.Event()
+        self._queues = [ctx.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._processes = [
+            ctx.Process(
+                target=_generation_worker,
+                args=(self.generator_kwargs, self.only_boards, self.batch_size, 
+                      self.chunk_size, seed, out_queue, stop_event),
+                daemon=True)
+            for seed, out_queue in zip(self.worker_seeds(), self._queues)]
+        for process in self._processes:
+            process.start()
+        self._finalizer = weakref.finalize(
+            self, _stop_generation_workers, stop_event, self._queues, self._processes)
+
+    def close(self) -> None:
+        """
+        Stops the workers. A later call starts a new pool, replaying the stream from its start.
+        """
+        with self._lock:
+            if self._finalizer is not None:
+                self._finalizer()
+            self._processes = self._queues = self._finalizer = None
+            self._next_worker = 0
+            self._pending.clear()
+
+    def _get_item(self):
+        # Called with the lock held
+        if self._processes is None:
+            self._start()
+        process = self._processes[self._next_worker]
+        out_queue = self._queues[self._next_worker]
+        while True:
+            try:
+                item = out_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(
+                        f'Data generation worker died with exit code {process.exitcode}')
+        self._next_worker = (self._next_worker + 1) % self.workers
+        return item
+
+    def _next(self):
+        with self._lock:
+            if self.batch_size:
+                return self._get_item()
+            if not self._pending:
+                self._pending.extend(zip(*self._get_item()))
+            return self._pending.popleft()
+
+    def __call__(self):
+        """
+        Python generator yielding samples (or batches if batch_size is set)
+        """
+        while True:
+            yield self._next()
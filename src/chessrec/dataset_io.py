@@ -0,0 +1,334 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import tensorflow as tf
+
+from chessrec.data_generator import ChessBoardGenerator, seed_everything, seeded
+
+
+"""
+Writing and loading of the generated datasets
+"""
+
+MANIFEST_FILE = "manifest.json"
+SHARD_NAME = "shard_{:05d}"
+MEMMAP_META_FILE = "memmap.json"
+MEMMAP_ARRAYS = {"images": np.uint8, "labels": np.uint8, "bboxes": np.float32}
+
+
+def shard_seed(seed: int, shard_idx: int) -> int:
+    """
+    Seed of a single shard - depends only on the base seed and the shard index,
+    so the content of a shard does not depend on the number of workers
+    """
+    return int(np.random.SeedSequence([seed, shard_idx]).generate_state(1)[0])
+
+
+def read_manifest(path: str) -> dict | None:
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _write_manifest(path: str, manifest: dict) -> None:
+    # Written to a temporary file first, so a crash never leaves a broken manifest
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _write_shard(
+        generator_kwargs: dict,
+        only_boards: bool,
+        shard_path: str,
+        n_samples: int,
+        seed: int,
+        render_batch_size: int) -> int:
+    """
+    Renders and saves one shard (as tf.data.Dataset.save). The shard is written
+    into a temporary directory and renamed once complete.
+    """
+    seed_everything(seed)
+    generator = ChessBoardGenerator(**generator_kwargs)
+    data = generator.tfGenerator(only_boards=only_boards, batch_size=render_batch_size or None)
+    if render_batch_size:
+        data = data.unbatch()
+    tmp_path = shard_path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    data.take(n_samples).save(tmp_path)
+    if os.path.exists(shard_path):
+        # Left by a run interrupted before recording the shard in the manifest
+        shutil.rmtree(shard_path)
+    os.replace(tmp_path, shard_path)
+    return n_samples
+
+
+def write_sharded_dataset(
+        generator: ChessBoardGenerator,
+        save_path: str,
+        dataset_size: int,
+        shard_size: int,
+        workers: int = 1,
+        seed: int = 0,
+        only_boards: bool = True,
+        render_batch_size: int = 0) -> dict:
+    """
+    Renders dataset_size samples into shards of shard_size samples, written in parallel
+    by a pool of worker processes. Completed shards are recorded in the manifest;
+    re-running with the same settings skips them, so an interrupted run can be resumed.
+    Returns the manifest.
+    """
+    settings = {
+        "dataset_size": dataset_size,
+        "shard_size": shard_size,
+        "seed": seed,
+        "only_boards": only_boards,
+        "render_batch_size": render_batch_size,
+        "generator": generator._init_kwargs,
+    }
+    os.makedirs(save_path, exist_ok=True)
+    manifest = read_manifest(save_path)
+    if manifest is None:
+        manifest = {"settings": settings, "shards": {}}
+        _write_manifest(save_path, manifest)
+    elif manifest["settings"] != settings:
+        raise ValueError(
+            f'Dataset in {save_path} was generated with different settings: {manifest["settings"]}')
+
+    n_shards = -(-dataset_size // shard_size)
+    todo = {}
+    for shard_idx in range(n_shards):
+        shard_name = SHARD_NAME.format(shard_idx)
+        if shard_name in manifest["shards"] and os.path.isdir(os.path.join(save_path, shard_name)):
+            continue
+        n_samples = min(shard_size, dataset_size - shard_idx*shard_size)
+        todo[shard_name] = (n_samples, shard_seed(seed, shard_idx))
+    print(f'Shards: {n_shards}, already complete: {n_shards - len(todo)}')
+
+    # Spawned (not forked) workers, as they run tensorflow themselves
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(
+                _write_shard,
+                generator._init_kwargs,
+                only_boards,
+                os.path.join(save_path, shard_name),
+                n_samples,
+                samples_seed,
+                render_batch_size): shard_name
+            for shard_name, (n_samples, samples_seed) in todo.items()}
+        for future in as_completed(futures):
+            shard_name = futures[future]
+            manifest["shards"][shard_name] = {"samples": future.result()}
+            _write_manifest(save_path, manifest)
+            print(f'{shard_name} done ({len(manifest["shards"])}/{n_shards})')
+    return manifest
+
+
+def load_sharded_dataset(path: str) -> tf.data.Dataset:
+    """
+    Loads all the shards listed in the manifest as one dataset (in the shard order).
+    Raises ValueError if the dataset is not complete yet.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise ValueError(f'No {MANIFEST_FILE} in {path}')
+    settings = manifest["settings"]
+    n_shards = -(-settings["dataset_size"] // settings["shard_size"])
+    shard_names = sorted(manifest["shards"])
+    if shard_names != [SHARD_NAME.format(shard_idx) for shard_idx in range(n_shards)]:
+        raise ValueError(
+            f'Dataset in {path} is incomplete ({len(shard_names)}/{n_shards} shards), '
+            f're-run the generation with the same settings to resume it')
+    dataset = tf.data.Dataset.load(os.path.join(path, shard_names[0]))
+    for shard_name in shard_names[1:]:
+        dataset = dataset.concatenate(tf.data.Dataset.load(os.path.join(path, shard_name)))
+    return dataset
+
+
+def export_memmap_dataset(
+        dataset: tf.data.Dataset, 
+        path: str, 
+        n_samples: int | None = None) -> int:
+    """
+    Stores the (unbatched) dataset of (image, label, bbox) as flat .npy arrays
+    images (N,H,W,C) uint8, labels (N,8,8) uint8 and bboxes (N,4) float32, which 
+    can be memory-mapped by load_memmap_dataset. The arrays are filled 
+    sample by sample, so the dataset does not have to fit in memory.
+    The meta file is written last and marks the export as complete.
+    Returns the number of exported samples.
+    """
+    if n_samples is None:
+        n_samples = int(dataset.cardinality())
+        if n_samples < 0:
+            raise ValueError("Size of the dataset is unknown, set n_samples explicitly")
+    dataset = dataset.take(n_samples)
+    img_spec, label_spec, bbox_spec = dataset.element_spec
+    shapes = {
+        "images": [n_samples, *img_spec.shape], 
+        "labels": [n_samples, *label_spec.shape], 
+        "bboxes": [n_samples, *bbox_spec.shape]}
+    os.makedirs(path, exist_ok=True)
+    # A previous export is not complete anymore once its arrays are overwritten
+    meta_path = os.path.join(path, MEMMAP_META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    arrays = {
+        name: np.lib.format.open_memmap(
+            os.path.join(path, f'{name}.npy'), mode="w+", dtype=dtype, shape=tuple(shapes[name]))
+        for name, dtype in MEMMAP_ARRAYS.items()}
+    exported = 0
+    for img, label, bbox in dataset.as_numpy_iterator():
+        arrays["images"][exported] = img
+        arrays["labels"][exported] = label
+        arrays["bboxes"][exported] = bbox
+        exported += 1
+    if exported != n_samples:
+        raise ValueError(f'Dataset has only {exported} samples, expected {n_samples}')
+    for array in arrays.values():
+        array.flush()
+    with open(meta_path, "w") as f:
+        json.dump({"samples": n_samples, "shapes": shapes}, f, indent=2)
+    return n_samples
+
+
+def open_memmap_arrays(path: str) -> dict[str, np.ndarray]:
+    """
+    Read-only memory maps of the arrays written by export_memmap_dataset.
+    Processes mapping the same files share one page-cached copy.
+    """
+    return {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode="r") 
+            for name in MEMMAP_ARRAYS}
+
+
+def load_memmap_dataset(
+        path: str, 
+        batch_size: int | None = None, 
+        shuffle: bool = False, 
+        seed: int | None = None) -> tf.data.Dataset:
+    """
+    Wraps the memory-mapped arrays as a tf dataset with the same elements as 
+    ChessBoardGenerator.tfGenerator. Nothing is deserialized or loaded upfront; 
+    each element (or batch, if batch_size is set) is copied from the mapped pages 
+    straight into its tensor. With shuffle, the order of the elements (batches) 
+    is reshuffled on every iteration.
+    """
+    arrays = open_memmap_arrays(path)
+    images, labels, bboxes = arrays["images"], arrays["labels"], arrays["bboxes"]
+    n_samples = len(images)
+
+    def fetch(start, stop):
+        return (
+            np.asarray(images[start:stop]), 
+            labels[start:stop].astype(np.int32), 
+            np.asarray(bboxes[start:stop]))
+
+    def fetch_tf(start):
+        stop = tf.minimum(start + (batch_size or 1), n_samples)
+        img, label, bbox = tf.numpy_function(
+            fetch, [start, stop], [tf.uint8, tf.int32, tf.float32], stateful=False)
+        img.set_shape([None, *images.shape[1:]])
+        label.set_shape([None, *labels.shape[1:]])
+        bbox.set_shape([None, *bboxes.shape[1:]])
+        if batch_size:
+            return img, label, bbox
+        return img[0], label[0], bbox[0]
+
+    dataset = tf.data.Dataset.range(0, n_samples, batch_size or 1)
+    if shuffle:
+        dataset = dataset.shuffle(-(-n_samples // (batch_size or 1)), seed=seed)
+    return dataset.map(fetch_tf, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+
+
+def load_dataset(path: str) -> tf.data.Dataset:
+    """
+    Loads a dataset saved by tf.data.Dataset.save, by write_sharded_dataset 
+    or by export_memmap_dataset
+    """
+    if os.path.isfile(os.path.join(path, MEMMAP_META_FILE)):
+        return load_memmap_dataset(path)
+    if read_manifest(path) is not None:
+        return load_sharded_dataset(path)
+    return tf.data.Dataset.load(path)
+
+
+def settings_key(generator: ChessBoardGenerator, **settings) -> str:
+    """
+    Short hash of the generator arguments and the given settings (e.g. seed and size)
+    """
+    dumped = json.dumps({"generator": generator._init_kwargs, **settings}, sort_keys=True)
+    return hashlib.sha1(dumped.encode()).hexdigest()[:16]
+
+
+def render_arrays(
+        generator: ChessBoardGenerator, 
+        n_samples: int, 
+        seed: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Renders n_samples boards with the given seed (the global random state is 
+    restored afterwards) as stacked arrays of images, labels and bboxes
+    """
+    with seeded(seed):
+        samples = generator.python_generator(only_boards=True)()
+        rendered = [next(samples) for _ in range(n_samples)]
+    img, label, bbox = zip(*rendered)
+    return np.stack(img), np.stack(label).astype(np.int32), np.stack(bbox).astype(np.float32)
+
+
+def cached_generated_path(
+        generator: ChessBoardGenerator, 
+        cache_dir: str, 
+        n_samples: int, 
+        seed: int) -> str:
+    """
+    Path of the memory-mapped arrays of n_samples boards rendered with the given seed.
+    They are rendered only once - stored in a subdirectory of cache_dir named by the 
+    settings_key, later calls with the same generator settings, size and seed reuse them.
+    Samples are streamed into the arrays, so the dataset does not have to fit in memory.
+    Exported into a temporary directory moved into place when complete, so processes
+    sharing cache_dir never overwrite arrays another one has mapped.
+    """
+    path = os.path.join(cache_dir, settings_key(generator, n_samples=n_samples, seed=seed))
+    meta_path = os.path.join(path, MEMMAP_META_FILE)
+    if os.path.isfile(meta_path):
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f'.{os.path.basename(path)}.', dir=cache_dir)
+    try:
+        with seeded(seed):
+            export_memmap_dataset(generator.tfGenerator(only_boards=True), tmp_path, n_samples)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Completed by another process meanwhile (its export is kept), or left incomplete
+            if not os.path.isfile(meta_path):
+                shutil.rmtree(path)
+                os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def cached_generated_dataset(
+        generator: ChessBoardGenerator, 
+        cache_dir: str, 
+        n_samples: int, 
+        seed: int,
+        batch_size: int | None = None) -> tf.data.Dataset:
+    """
+    Memory-mapped dataset of n_samples boards rendered with the given seed,
+    see cached_generated_path()
+    """
+    return load_memmap_dataset(
+        cached_generated_path(generator, cache_dir, n_samples, seed), batch_size)
@@ -1,5 +1,7 @@
 import os
+from collections import OrderedDict
 import chessrec.constants as const
+from chessrec.compositing import PremultipliedSprite
 import numpy as np
 import cv2
 
@@ -35,51 +37,106 @@ def place_piece_on_board(
     ) -> np.ndarray:
     """
     Takes an image of a board and puts an image of a piece on the given position.
+    Already resized pieces (e.g. from asset_cache.SpriteAtlas) are used as they are.
     """
     piece_w = board.shape[0] // const.BOARD_FILES
     piece_h =  board.shape[1] // const.BOARD_RANKS
-    piece = cv2.resize(piece, (piece_w, piece_h))
+    if piece.shape[:2] != (piece_h, piece_w):
+        piece = cv2.resize(piece, (piece_w, piece_h))
     x_offset = file*piece_w
     y_offset = (const.BOARD_RANKS - rank - 1)*piece_h
     return overlay_png_images(board, piece, y_offset, x_offset)
 
+def place_sprite_on_board(
+        board: np.ndarray,
+        sprite: PremultipliedSprite,
+        file: int,
+        rank: int
+    ) -> np.ndarray:
+    """
+    Same as place_piece_on_board for an already resized, premultiplied 
+    piece sprite; blended in place with integer arithmetic.
+    """
+    piece_w = board.shape[0] // const.BOARD_FILES
+    piece_h =  board.shape[1] // const.BOARD_RANKS
+    x_offset = file*piece_w
+    y_offset = (const.BOARD_RANKS - rank - 1)*piece_h
+    return sprite.blend(board, y_offset, x_offset)
+
+class PositionRenderer():
+    """
+    Recreates images of encoded positions from the default assets. The board and 
+    pieces are loaded, resized and composited once into one tile per 
+    (piece, rank, file); rendering is then just slicing of the pre-composited tiles.
+    The last cache_size rendered images are kept, keyed by the encoding bytes.
+    Returned images are shared and read-only.
+    """
+    def __init__(
+            self,
+            assets_path: str = const.DEFAULT_ASSETS_FILE,
+            height: int = const.DECODED_H,
+            width: int = const.DECODED_W,
+            cache_size: int = 32) -> None:
+        self.cache_size = cache_size
+        self._rendered: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        board = cv2.imread(os.path.join(assets_path, const.DEFAULT_BOARD), cv2.IMREAD_UNCHANGED)
+        board = cv2.cvtColor(board, cv2.COLOR_BGR2RGBA)
+        board = cv2.resize(board, (width, height))
+        piece_w = board.shape[0] // const.BOARD_FILES
+        piece_h =  board.shape[1] // const.BOARD_RANKS
+        board_squares = board[:piece_h*const.BOARD_RANKS, :piece_w*const.BOARD_FILES].reshape(
+            [const.BOARD_RANKS, piece_h, const.BOARD_FILES, piece_w, -1]).transpose([0, 2, 1, 3, 4])
+
+        # tiles[code, row, file] - row 0 is the top row of the image
+        self._tiles = np.repeat(board_squares[None], const.SQUARE_CLASSES, axis=0)
+        for piece, code in const.PIECES_ENCODING.items():
+            piece_image = cv2.imread(
+                os.path.join(assets_path, const.DEFAULT_SET_PIECE, f'{piece}.png'), 
+                cv2.IMREAD_UNCHANGED)
+            piece_image = cv2.resize(piece_image, (piece_w, piece_h))
+            for row in range(const.BOARD_RANKS):
+                for file in range(const.BOARD_FILES):
+                    overlay_png_images(self._tiles[code, row, file], piece_image, 0, 0)
+        self._board = board
+
+    def render(self, encoded_pos: np.ndarray) -> np.ndarray:
+        """
+        Takes an encoded position and recreates the image of the board.
+        Zero-copy - the result is read-only and shared with the cache (and with
+        other calls rendering the same position), copy it before modifying.
+        """
+        encoded_pos = np.asarray(encoded_pos, dtype=np.uint8)
+        key = encoded_pos.tobytes()
+        if key in self._rendered:
+            self._rendered.move_to_end(key)
+            return self._rendered[key]
+
+        rows, files = np.indices(encoded_pos.shape)
+        squares = self._tiles[encoded_pos, rows, files]
+        tiled = squares.transpose([0, 2, 1, 3, 4]).reshape(
+            [squares.shape[0]*squares.shape[2], squares.shape[1]*squares.shape[3], -1])
+        position_image = self._board.copy()
+        position_image[:tiled.shape[0], :tiled.shape[1]] = tiled
+        position_image.setflags(write=False)
+
+        self._rendered[key] = position_image
+        if len(self._rendered) > self.cache_size:
+            self._rendered.popitem(last=False)
+        return position_image
+
+
+_default_renderer: PositionRenderer | None = None
+
 def decode_position(encoded_pos: np.ndarray) -> np.ndarray:
     """
     Takes an encoded position and recreates the image of the board
+    (using the shared PositionRenderer of the default assets). Returns a
+    writable copy, PositionRenderer.render() avoids it.
     """
-    types = list(const.PIECES_ENCODING.keys())
-    codes = list(const.PIECES_ENCODING.values())
-    encoded_pos = np.flip(encoded_pos, axis = 0)
-    position_image = cv2.imread(
-        os.path.join(const.DEFAULT_ASSETS_FILE, const.DEFAULT_BOARD),
-        cv2.IMREAD_UNCHANGED
-    )
-
-    position_image = cv2.cvtColor(position_image, cv2.COLOR_BGR2RGBA)
-    position_image = cv2.resize(
-        position_image, (const.DECODED_W, const.DECODED_H)
-    )
-    for rank in range(const.BOARD_RANKS):
-        for file in range(const.BOARD_FILES):
-          piece_encode = encoded_pos[rank, file]
-          if piece_encode !=0 :
-            piece = types[codes.index(piece_encode)]
-            piece_image = cv2.imread(
-                os.path.join(
-                    const.DEFAULT_ASSETS_FILE, const.DEFAULT_SET_PIECE, f'{piece}.png'
-                ),
-                cv2.IMREAD_UNCHANGED
-            )
-            position_image = place_piece_on_board(
-                position_image, 
-                piece_image, 
-                file, 
-                rank
-            )
-        position_image = cv2.resize(
-            position_image, (const.DECODED_W, const.DECODED_H)
-        )
-    return position_image
+    global _default_renderer
+    if _default_renderer is None:
+        _default_renderer = PositionRenderer()
+    return _default_renderer.render(encoded_pos).copy()
 
 def encoding_to_FEN(encoded_pos: np.ndarray) -> str:
     """
@@ -104,3 +161,93 @@ def encoding_to_FEN(encoded_pos: np.ndarray) -> str:
             current_empty = 0
         FEN += "/"
     return FEN[:-1]
+
+
+def _fen_lookup_tables() -> tuple[np.ndarray, np.ndarray]:
+    """
+    code -> FEN character (ASCII, 0 for an empty square) and
+    ASCII -> code (-1 for characters that are not pieces)
+    """
+    code_to_char = np.zeros(const.SQUARE_CLASSES, dtype=np.uint8)
+    char_to_code = np.full(256, -1, dtype=np.int16)
+    for piece, code in const.PIECES_ENCODING_FEN.items():
+        code_to_char[code] = ord(piece)
+        char_to_code[ord(piece)] = code
+    return code_to_char, char_to_code
+
+_FEN_CODE_TO_CHAR, _FEN_CHAR_TO_CODE = _fen_lookup_tables()
+
+def encodings_to_fens(encoded_pos: np.ndarray) -> list[str]:
+    """
+    Batch version of encoding_to_FEN for (N,8,8) encodings. Runs of empty squares 
+    are counted with cumulative maxima, every rank is laid out as fixed-width bytes 
+    (digit + piece per square, trailing digit, separator) and the unused bytes are 
+    dropped at once.
+    """
+    encoded_pos = np.asarray(encoded_pos)
+    n, ranks, files = encoded_pos.shape
+    if n == 0:
+        return []
+    is_piece = encoded_pos != 0
+    files_idx = np.arange(files)
+    last_piece = np.maximum.accumulate(np.where(is_piece, files_idx, -1), axis=-1)
+    previous_piece = np.concatenate(
+        [np.full([n, ranks, 1], -1), last_piece[...,:-1]], axis=-1)
+    empty_before = files_idx - 1 - previous_piece
+    empty_after = files - 1 - last_piece[...,-1]
+
+    layout = np.zeros([n, ranks, 2*files + 2], dtype=np.uint8)
+    layout[...,0:2*files:2] = np.where(is_piece & (empty_before > 0), empty_before + ord('0'), 0)
+    layout[...,1:2*files:2] = _FEN_CODE_TO_CHAR[encoded_pos]
+    layout[...,-2] = np.where(empty_after > 0, empty_after + ord('0'), 0)
+    layout[:,:-1,-1] = ord('/')
+
+    layout = layout.reshape([n, ranks * (2*files + 2)])
+    used = layout != 0
+    ends = np.cumsum(used.sum(axis=1))
+    starts = ends - used.sum(axis=1)
+    joined = layout[used].tobytes().decode('ascii')
+    return [joined[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+def fens_to_encodings(fens: list[str], dtype=np.uint8) -> np.ndarray:
+    """
+    Inverse of encodings_to_fens: parses the piece placement field of the FENs
+    (other fields are ignored) into (N,8,8) encodings. All the FENs are parsed 
+    at once - each character gets its width in squares and the square index 
+    is the cumulative sum of the widths.
+    """
+    if len(fens) == 0:
+        return np.zeros([0, const.BOARD_RANKS, const.BOARD_FILES], dtype=dtype)
+    placements = [fen.split(" ", 1)[0] for fen in fens]
+    lengths = np.array([len(placement) for placement in placements])
+    chars = np.frombuffer("".join(placements).encode('ascii'), dtype=np.uint8)
+    fen_idx = np.repeat(np.arange(len(placements)), lengths)
+
+    codes = _FEN_CHAR_TO_CODE[chars]
+    is_digit = (chars >= ord('1')) & (chars <= ord(str(const.BOARD_FILES)))
+    is_separator = chars == ord('/')
+    if not (is_digit | is_separator | (codes > 0)).all():
+        bad = fen_idx[~(is_digit | is_separator | (codes > 0))][0]
+        raise ValueError(f'Invalid character in FEN: {fens[bad]}')
+
+    width = np.where(is_digit, chars.astype(np.int64) - ord('0'), (codes > 0).astype(np.int64))
+    # Exclusive cumulative sums restarted at the beginning of every FEN
+    fen_starts = np.concatenate([[0], np.cumsum(lengths)])[:-1]
+    squares_before = np.concatenate([[0], np.cumsum(width)])
+    separators_before = np.concatenate([[0], np.cumsum(is_separator)])
+    square = squares_before[:-1] - np.repeat(squares_before[fen_starts], lengths)
+    rank = separators_before[:-1] - np.repeat(separators_before[fen_starts], lengths)
+
+    squares_per_fen = np.bincount(fen_idx, weights=width, minlength=len(placements))
+    separators_per_fen = np.bincount(fen_idx, weights=is_separator, minlength=len(placements))
+    invalid = (squares_per_fen != const.N_SQUARES) | (separators_per_fen != const.BOARD_RANKS - 1)
+    # Every rank has to be complete before its separator
+    misplaced_separator = is_separator & (square != (rank + 1) * const.BOARD_FILES)
+    invalid[fen_idx[misplaced_separator]] = True
+    if invalid.any():
+        raise ValueError(f'Invalid piece placement in FEN: {fens[int(np.flatnonzero(invalid)[0])]}')
+
+    encodings = np.zeros([len(placements), const.N_SQUARES], dtype=dtype)
+    pieces = codes > 0
+    encodings[fen_idx[pieces], square[pieces]] = codes[pieces]
+    return encodings.reshape([len(placements), const.BOARD_RANKS, const.BOARD_FILES])
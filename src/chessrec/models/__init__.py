@@ -22,20 +22,77 @@ def bbox_yxyx_to_ts(boxes):
 
 
 class RecognizerBase(tf.keras.Model):
+    # Supported global dtype policies, see set_precision()
+    PRECISIONS = ["float32", "mixed_bfloat16"]
+    # Input of the compiled inference, see predict_classes()
+    INPUT_SHAPE = (256, 256, 1)
+
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
+        self._predict_fn = None
+        self._classes_fn = None
+        self._jit_compile = False
+
+    @staticmethod
+    def set_precision(precision: str = "float32") -> None:
+        """
+        Sets the global keras dtype policy - has to be called before the model is created.
+        With "mixed_bfloat16", layers compute in bfloat16 while keeping float32 weights
+        (the output softmax stays float32).
+        """
+        if precision not in RecognizerBase.PRECISIONS:
+            raise ValueError(f'Unsupported precision {precision}, use one of {RecognizerBase.PRECISIONS}')
+        tf.keras.mixed_precision.set_global_policy(precision)
+
+    def set_jit_compile(self, jit_compile: bool = True) -> None:
+        """
+        Runs predict() as a XLA compiled tf.function (or eagerly again if False).
+        For training, pass jit_compile to self.compile().
+        """
+        self._predict_fn = tf.function(self._predict, jit_compile=True) if jit_compile else None
+        self._jit_compile = jit_compile
+        self._classes_fn = None
 
     def save_model(self, save_path):
         self.save_weights(save_path, save_format="h5")
 
-    def load_model(self, load_path):
+    def load_model(self, load_path, warm_up: bool = True):
         self.load_weights(load_path) 
+        if warm_up:
+            self.warm_up()
 
-    def predict(self, inputs):
+    def _classes(self, inputs):
+        predicitons = self(inputs, training = False)
+        return tf.cast(tf.math.argmax(predicitons, axis=-1), tf.uint8)
+
+    def predict_classes(self, inputs) -> tf.Tensor:
+        """
+        Compiled inference - float32 images (B,*INPUT_SHAPE) to uint8 class indices (B,8,8).
+        Traced once for the fixed signature (any batch size), see warm_up().
+        """
+        if self._classes_fn is None:
+            self._classes_fn = tf.function(
+                self._classes,
+                input_signature=[tf.TensorSpec([None, *self.INPUT_SHAPE], tf.float32)],
+                jit_compile=self._jit_compile)
+        return self._classes_fn(inputs)
+
+    def warm_up(self, batch_size: int = 1) -> None:
+        """
+        Traces (and runs once) the compiled inference, so the first real call does not pay for it
+        """
+        self.predict_classes(tf.zeros([batch_size, *self.INPUT_SHAPE], tf.float32))
+
+    def _predict(self, inputs):
         predicitons = self(inputs, training = False)
         predicitons = tf.math.argmax(predicitons, axis=-1)
         return predicitons
 
+    def predict(self, inputs):
+        if self._predict_fn is not None:
+            return self._predict_fn(inputs)
+        return self._predict(inputs)
+
 
 ### TODO: This is basically just a playground at this point and can be fully ignored
 class DetectorBase(tf.keras.Model):
@@ -15,6 +15,33 @@ class BoardAccuracy(tf.keras.metrics.Accuracy):
         return super().update_state(tf.ones_like(boards_equal), boards_equal)
 
 
+class SparseBoardAccuracy(tf.keras.metrics.Accuracy):
+    """
+    BoardAccuracy for labels given as (B,8,8) class indices - compares 
+    the argmax of the predictions directly, without one-hot encoding
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        y_pred = tf.math.argmax(y_pred, axis = -1, output_type=tf.int32)
+        y_true = tf.cast(y_true, tf.int32)
+        boards_equal = tf.math.reduce_all(tf.math.equal(y_pred, y_true), axis = (1,2))
+        return super().update_state(tf.ones_like(boards_equal), boards_equal)
+
+
+class SparseSquareAccuracy(tf.keras.metrics.Mean):
+    """
+    Square accuracy for labels given as (B,8,8) class indices, 
+    integer comparison of the predicted and true classes
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        y_pred = tf.math.argmax(y_pred, axis = -1, output_type=tf.int32)
+        squares_equal = tf.math.equal(y_pred, tf.cast(y_true, tf.int32))
+        return super().update_state(tf.cast(squares_equal, self.dtype))
+
+
 class IoU(tf.keras.metrics.Metric):
     def __init__(self, name='iou', **kwargs):
         super().__init__(name=name, **kwargs)
@@ -29,7 +29,8 @@ class PositionRecognizer(RecognizerBase):
         self.resize_hidden = tf.keras.layers.Resizing(8, 8)
         self.dense_1 = tf.keras.layers.Dense(256, activation=tf.nn.relu)
         self.dropout = tf.keras.layers.Dropout(0.5)
-        self.dense_out = tf.keras.layers.Dense(13, activation=tf.nn.softmax)
+        # Softmax output always in float32, also under the mixed precision policy
+        self.dense_out = tf.keras.layers.Dense(13, activation=tf.nn.softmax, dtype="float32")
 
         # TODO: This is just a cheat to make self.summary() work properly.
         # Double check if it does not interfere with anything
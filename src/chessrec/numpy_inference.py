@@ -0,0 +1,301 @@
+import os
+
+import h5py
+import numpy as np
+
+
+"""
+TensorFlow-free inference of the PositionRecognizer (models/position_recognizer_v0.py).
+The forward pass is reimplemented in NumPy and the weights are read directly
+from the h5 file written by RecognizerBase.save_model.
+"""
+
+# Input of the recognizer, (256,256) grey-scale images
+INPUT_SHAPE = (256, 256, 1)
+
+DEFAULT_WEIGHTS = os.path.join(
+    os.path.dirname(__file__), "models", "trained_weights", "position_recognizer_v0.h5")
+
+# Layers of PositionRecognizer.call, in order. Weights of the conv/dense layers are taken
+# from the h5 file in the same order, strides and activations are not stored there.
+ARCHITECTURE = [
+    ("resize", (128, 128)),
+    ("conv", 1),
+    ("conv", 1),
+    ("conv", 2),
+    ("conv", 2),
+    ("conv", 2),
+    ("resize", (8, 8)),
+    ("dense", "relu"),
+    ("dense", "softmax"),
+]
+
+
+def read_h5_weights(path: str) -> list[tuple[np.ndarray, ...]]:
+    """
+    Weights of the layers with weights (e.g. (kernel, bias)), in the order of the layers
+    as saved by keras save_weights(save_format="h5")
+    """
+    weights = []
+    with h5py.File(path, "r") as f:
+        for layer_name in f.attrs["layer_names"]:
+            layer_name = layer_name.decode("utf8") if isinstance(layer_name, bytes) else layer_name
+            group = f[layer_name]
+            weight_names = [
+                name.decode("utf8") if isinstance(name, bytes) else name
+                    for name in group.attrs["weight_names"]]
+            if weight_names:
+                weights.append(tuple(np.asarray(group[name], dtype=np.float32) for name in weight_names))
+    return weights
+
+
+def _bilinear_axis(in_size: int, out_size: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Same as tf.image.resize(method="bilinear") - half pixel centers, no antialiasing
+    scale = in_size / out_size
+    position = (np.arange(out_size, dtype=np.float32) + 0.5) * scale - 0.5
+    floor = np.floor(position)
+    lower = np.maximum(floor, 0).astype(np.int64)
+    upper = np.minimum(np.ceil(position), in_size - 1).astype(np.int64)
+    lerp = (position - floor).astype(np.float32)
+    return lower, upper, lerp
+
+
+def resize_bilinear(images: np.ndarray, size: tuple[int, int]) -> np.ndarray:
+    """
+    Bilinear resize of (B,H,W,C) images, matching keras.layers.Resizing
+    """
+    top, bottom, y_lerp = _bilinear_axis(images.shape[1], size[0])
+    left, right, x_lerp = _bilinear_axis(images.shape[2], size[1])
+    y_lerp = y_lerp[None, :, None, None]
+    x_lerp = x_lerp[None, None, :, None]
+    rows = images[:, top] + (images[:, bottom] - images[:, top]) * y_lerp
+    return rows[:, :, left] + (rows[:, :, right] - rows[:, :, left]) * x_lerp
+
+
+def conv2d(images: np.ndarray, kernel: np.ndarray, bias: np.ndarray, stride: int) -> np.ndarray:
+    """
+    "valid" convolution of (B,H,W,C) images with a (kh,kw,C,F) kernel, as one matrix product
+    """
+    kh, kw = kernel.shape[:2]
+    windows = np.lib.stride_tricks.sliding_window_view(images, (kh, kw), axis=(1, 2))
+    windows = windows[:, ::stride, ::stride]
+    # windows: (B, H', W', C, kh, kw) -> kernel reordered to (C, kh, kw, F)
+    out = np.tensordot(windows, kernel.transpose(2, 0, 1, 3), axes=3)
+    out += bias
+    return out
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class NumpyPositionRecognizer():
+    """
+    Drop-in replacement of PositionRecognizer for inference - takes the same
+    (B,256,256,1) float32 images (grey levels 0-255) and gives the same outputs,
+    without importing TensorFlow.
+    """
+    def __init__(self, weights_path: str = DEFAULT_WEIGHTS) -> None:
+        self.load_model(weights_path)
+
+    def load_model(self, load_path: str) -> None:
+        weights = read_h5_weights(load_path)
+        n_weighted = sum(kind in ("conv", "dense") for kind, _ in ARCHITECTURE)
+        if len(weights) != n_weighted:
+            raise ValueError(
+                f'{load_path} has weights of {len(weights)} layers, expected {n_weighted}')
+        weights = iter(weights)
+        # (kind, param, weights) per layer, the part before the last resize is the convolutional backbone
+        self.layers = [
+            (kind, param, next(weights) if kind in ("conv", "dense") else None)
+                for kind, param in ARCHITECTURE]
+        last_resize = max(i for i, (kind, _) in enumerate(ARCHITECTURE) if kind == "resize")
+        self.backbone = self.layers[:last_resize]
+        self.classifier = self.layers[last_resize:]
+
+    @staticmethod
+    def _run(layers: list, hidden: np.ndarray, relative_resize: bool = False) -> np.ndarray:
+        for kind, param, weights in layers:
+            if kind == "resize" and relative_resize:
+                # Sizes given for the full INPUT_SHAPE images, inputs of other sizes are scaled in proportion
+                hidden = resize_bilinear(hidden, (
+                    hidden.shape[1] * param[0] // INPUT_SHAPE[0], hidden.shape[2] * param[1] // INPUT_SHAPE[1]))
+            elif kind == "resize":
+                hidden = resize_bilinear(hidden, param)
+            elif kind == "conv":
+                hidden = np.maximum(conv2d(hidden, *weights, stride=param), 0)
+            else:
+                kernel, bias = weights
+                hidden = hidden @ kernel + bias
+                hidden = np.maximum(hidden, 0) if param == "relu" else softmax(hidden)
+        return hidden
+
+    def features(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Output of the convolutional backbone, (B,14,14,128) for the (B,256,256,1) images.
+        Convolutions are "valid", so it can be computed on crops of the images as well
+        (see IncrementalRecognizer), which are resized with the same scale as the full images.
+        """
+        return self._run(self.backbone, np.asarray(inputs, dtype=np.float32) / np.float32(255.), relative_resize=True)
+
+    def head(self, features: np.ndarray) -> np.ndarray:
+        """
+        Softmax probabilities (B,8,8,13) of the backbone features
+        """
+        return self._run(self.classifier, features)
+
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Softmax probabilities (B,8,8,13)
+        """
+        return self.head(self.features(inputs))
+
+    def predict(self, inputs: np.ndarray) -> np.ndarray:
+        return np.argmax(self(inputs), axis=-1)
+
+    def predict_classes(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        uint8 class indices (B,8,8), same as RecognizerBase.predict_classes
+        """
+        return self.predict(inputs).astype(np.uint8)
+
+
+class IncrementalRecognizer():
+    """
+    Recognizer of consecutive captures of the same board (e.g. a live game).
+    The (256,256) input is split into 8x8 square tiles, each fingerprinted by its
+    4x4 block means. Only the tiles whose fingerprint moved by more than threshold
+    grey levels are processed again - the backbone features cached from the previous
+    capture are recomputed on crops around them, and only the squares depending on
+    the recomputed features are re-classified and merged into the previous encoding.
+    With nothing changed, the previous encoding is returned right away.
+    """
+    TILES = 8
+    FINGERPRINT_BLOCK = 4
+
+    def __init__(self, recognizer: NumpyPositionRecognizer, threshold: float = 8.0) -> None:
+        self.recognizer = recognizer
+        self.threshold = threshold
+        self._geometry()
+        self.reset()
+        # Statistics, see self.stats()
+        self.calls = 0
+        self.full_calls = 0
+        self.recomputed_tiles = 0
+        self.recomputed_pixels = 0
+
+    def _geometry(self) -> None:
+        # Input rows/cols each backbone feature cell depends on: [scale*(stride*j), scale*(stride*j + field))
+        height, width, _ = INPUT_SHAPE
+        kind, size, _ = self.recognizer.backbone[0]
+        if kind != "resize" or height % size[0] or width % size[1] or height // size[0] != width // size[1]:
+            raise ValueError("Incremental recognition needs a backbone starting by an integer downscale")
+        self.scale = height // size[0]
+        self.stride, self.field = 1, 1
+        for kind, stride, weights in self.recognizer.backbone[1:]:
+            if kind != "conv":
+                raise ValueError(f'Incremental recognition does not support "{kind}" layers in the backbone')
+            self.field += (weights[0].shape[0] - 1) * self.stride
+            self.stride *= stride
+        self.tile_size = height // self.TILES
+        self.feature_size = self.recognizer.features(np.zeros([1, *INPUT_SHAPE], np.float32)).shape[1]
+        # Cells of the last resize used by every output square (its bilinear neighbours)
+        _, out_size, _ = self.recognizer.classifier[0]
+        lower, upper, _ = _bilinear_axis(self.feature_size, out_size[0])
+        self._square_cells = [{int(low), int(up)} for low, up in zip(lower, upper)]
+
+    def reset(self) -> None:
+        """
+        Forgets the previous capture, the next one is recognized in full
+        """
+        self._fingerprint: np.ndarray | None = None
+        self._features: np.ndarray | None = None
+        self._encoding: np.ndarray | None = None
+
+    def _fingerprints(self, image: np.ndarray) -> np.ndarray:
+        # (8,8,n,n) block means of the tiles
+        block = self.FINGERPRINT_BLOCK
+        n = self.tile_size // block
+        blocks = image.reshape(self.TILES, n, block, self.TILES, n, block)
+        return blocks.mean(axis=(2, 5)).transpose(0, 2, 1, 3)
+
+    def _cells(self, tile: int) -> tuple[int, int]:
+        # First and last feature cells whose input span overlaps the tile
+        span = self.scale * self.stride
+        first = max(0, -(-(tile * self.tile_size - self.scale * self.field + 1) // span))
+        last = min(self.feature_size - 1, ((tile + 1) * self.tile_size - 1) // span)
+        return first, last
+
+    @staticmethod
+    def _merge_boxes(boxes: list[list[int]]) -> list[list[int]]:
+        # Overlapping cell boxes (top, bottom, left, right) are recomputed together
+        merged = []
+        for box in boxes:
+            for other in merged:
+                if box[0] <= other[1] and other[0] <= box[1] and box[2] <= other[3] and other[2] <= box[3]:
+                    other[:] = [min(box[0], other[0]), max(box[1], other[1]), min(box[2], other[2]), max(box[3], other[3])]
+                    break
+            else:
+                merged.append(list(box))
+        return merged
+
+    def _recompute(self, image: np.ndarray, changed: np.ndarray) -> np.ndarray:
+        """
+        Recomputes the features around the changed tiles, returns the mask of the affected squares
+        """
+        boxes = self._merge_boxes([[*self._cells(row), *self._cells(col)] for row, col in np.argwhere(changed)])
+        affected = np.zeros([self.TILES, self.TILES], dtype=bool)
+        span = self.scale * self.stride
+        for top, bottom, left, right in boxes:
+            crop = image[
+                top * span:bottom * span + self.scale * self.field,
+                left * span:right * span + self.scale * self.field]
+            self._features[:, top:bottom + 1, left:right + 1] = self.recognizer.features(crop[None, ..., None])
+            self.recomputed_pixels += crop.size
+            rows = [i for i, cells in enumerate(self._square_cells) if cells & set(range(top, bottom + 1))]
+            cols = [i for i, cells in enumerate(self._square_cells) if cells & set(range(left, right + 1))]
+            affected[np.ix_(rows, cols)] = True
+        return affected
+
+    def predict_classes(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        uint8 class indices (1,8,8) of a single capture (1,256,256,1), same as
+        NumpyPositionRecognizer.predict_classes up to the squares below the threshold
+        """
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if inputs.shape != (1, *INPUT_SHAPE):
+            raise ValueError(f'Incremental recognition takes a single {INPUT_SHAPE} image, got {inputs.shape}')
+        image = inputs[0, ..., 0]
+        fingerprint = self._fingerprints(image)
+        self.calls += 1
+        if self._fingerprint is None:
+            self._features = self.recognizer.features(inputs)
+            self._encoding = np.argmax(self.recognizer.head(self._features)[0], axis=-1).astype(np.uint8)
+            self._fingerprint = fingerprint
+            self.full_calls += 1
+            return self._encoding[None].copy()
+        changed = np.abs(fingerprint - self._fingerprint).max(axis=(2, 3)) > self.threshold
+        if changed.any():
+            affected = self._recompute(image, changed)
+            # Unchanged tiles keep their old fingerprint, so slow drifts are still caught
+            self._fingerprint[changed] = fingerprint[changed]
+            self.recomputed_tiles += int(changed.sum())
+            encoding = np.argmax(self.recognizer.head(self._features)[0], axis=-1).astype(np.uint8)
+            self._encoding[affected] = encoding[affected]
+        return self._encoding[None].copy()
+
+    def stats(self) -> dict:
+        """
+        Number of captures, of the full recognitions and of the recomputed tiles,
+        and the recomputed input pixels relative to full recognitions of every capture
+        """
+        full_pixels = self.calls * INPUT_SHAPE[0] * INPUT_SHAPE[1]
+        return {
+            "calls": self.calls,
+            "full_calls": self.full_calls,
+            "recomputed_tiles": self.recomputed_tiles,
+            "computed_fraction": (
+                (self.full_calls * INPUT_SHAPE[0] * INPUT_SHAPE[1] + self.recomputed_pixels) / full_pixels
+                if full_pixels else 0.0),
+        }
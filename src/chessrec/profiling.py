@@ -0,0 +1,100 @@
+import json
+import time
+import threading
+import functools
+from collections import deque
+
+import numpy as np
+
+
+"""
+Opt-in stage timers. Objects are instrumented by wrapping their methods
+at the instance level, so nothing is measured (nor slowed down) unless enabled.
+"""
+
+class StageProfiler():
+    """
+    Cumulative time and number of calls per stage, and latency percentiles
+    computed from the last `window` calls of each stage.
+    Times of nested stages are inclusive (e.g. _create_board contains _crop_and_resize).
+    Thread-safe - stages may be recorded by several threads (e.g. the tf.data
+    threads and the replay buffer producer) while the results are read or reset.
+    """
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, window: int = 10000) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.total: dict[str, float] = {}
+            self.count: dict[str, int] = {}
+            self._latencies: dict[str, deque] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self.total:
+                self.total[stage] = 0.0
+                self.count[stage] = 0
+                self._latencies[stage] = deque(maxlen=self.window)
+            self.total[stage] += seconds
+            self.count[stage] += 1
+            self._latencies[stage].append(seconds)
+
+    def wrap(self, stage: str, fn):
+        """
+        Returns fn timed as the given stage
+        """
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def instrument(self, obj, stages: list[str]) -> None:
+        """
+        Replaces the methods named in stages by their timed versions on this instance
+        """
+        for stage in stages:
+            obj.__dict__.pop(stage, None)
+            setattr(obj, stage, self.wrap(stage, getattr(obj, stage)))
+
+    @staticmethod
+    def uninstrument(obj, stages: list[str]) -> None:
+        for stage in stages:
+            obj.__dict__.pop(stage, None)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Per stage: number of calls, total and mean time and latency percentiles (in ms)
+        """
+        with self._lock:
+            recorded = {
+                stage: (total, self.count[stage], list(self._latencies[stage])) 
+                    for stage, total in self.total.items()}
+        summary = {}
+        for stage, (total, count, latencies) in recorded.items():
+            latencies = np.array(latencies, dtype=np.float64) * 1000
+            percentiles = np.percentile(latencies, self.PERCENTILES)
+            summary[stage] = {
+                "count": count,
+                "total_s": total,
+                "mean_ms": total / count * 1000,
+                **{f'p{p}_ms': float(value) for p, value in zip(self.PERCENTILES, percentiles)},
+            }
+        return summary
+
+    def to_json(self, path: str | None = None) -> str:
+        """
+        Summary as JSON string, also written to the path if given
+        """
+        dumped = json.dumps(self.summary(), indent=2)
+        if path:
+            with open(path, "w") as f:
+                f.write(dumped)
+        return dumped
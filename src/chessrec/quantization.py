@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import tensorflow as tf
+
+
+"""
+Int8 post-training quantization of the recognizer (TFLite) and the runtime
+of the quantized model, for inference on low-end CPUs
+"""
+
+def export_int8(
+        recognizer: tf.keras.Model,
+        representative_images: np.ndarray,
+        save_path: str) -> int:
+    """
+    Converts the recognizer to a fully int8 quantized TFLite model, with the activation
+    ranges calibrated on the representative images (N,256,256,1 float32 grey levels).
+    The model takes uint8 images and gives uint8 probabilities (scale 1/256).
+    Returns the size of the saved model in bytes.
+    """
+    def representative_dataset():
+        for image in representative_images:
+            yield [image[None].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(recognizer)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+    model = converter.convert()
+    with open(save_path + ".tmp", "wb") as f:
+        f.write(model)
+    os.replace(save_path + ".tmp", save_path)
+    return len(model)
+
+
+class QuantizedRecognizer():
+    """
+    TFLite runtime of a model exported by export_int8(), with the predict contract
+    of RecognizerBase - (B,256,256,1) images (grey levels 0-255) to (B,8,8) class
+    indices, returned as numpy arrays
+    """
+    def __init__(self, model_path: str, num_threads: int | None = None) -> None:
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+
+    def _quantize(self, inputs: np.ndarray) -> np.ndarray:
+        scale, zero_point = self._input["quantization"]
+        dtype = self._input["dtype"]
+        if scale == 0:
+            return np.asarray(inputs, dtype=dtype)
+        limits = np.iinfo(dtype)
+        quantized = np.round(np.asarray(inputs, dtype=np.float32) / scale + zero_point)
+        return np.clip(quantized, limits.min, limits.max).astype(dtype)
+
+    def _invoke(self, inputs: np.ndarray) -> np.ndarray:
+        if len(inputs) != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input["index"], [len(inputs), *inputs.shape[1:]])
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = len(inputs)
+        self.interpreter.set_tensor(self._input["index"], self._quantize(inputs))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output["index"])
+
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Dequantized softmax probabilities (B,8,8,13)
+        """
+        outputs = self._invoke(inputs).astype(np.float32)
+        scale, zero_point = self._output["quantization"]
+        return (outputs - zero_point) * scale if scale else outputs
+
+    def predict(self, inputs: np.ndarray) -> np.ndarray:
+        # argmax of the quantized outputs is the same as of the dequantized ones
+        return np.argmax(self._invoke(inputs), axis=-1)
+
+    def predict_classes(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        uint8 class indices (B,8,8), same as RecognizerBase.predict_classes
+        """
+        return self.predict(inputs).astype(np.uint8)
@@ -0,0 +1,352 @@
+import time
+import threading
+from collections import deque
+from typing import Callable
+
+import numpy as np
+import tensorflow as tf
+
+import chessrec.constants as const
+
+
+"""
+Bounded in-memory pools of training samples - pre-rendered samples refreshed
+by a background producer while the training samples from them (ReplayBuffer),
+and the misclassified samples mixed back into the training (HardExampleBuffer)
+"""
+
+class ReplayBuffer():
+    """
+    Pool of pool_size samples (image, label, bbox), drawn uniformly at random
+    by self.dataset(). A background thread consumes the source (python generator
+    function yielding samples or batches, e.g. ChessBoardGenerator.python_generator())
+    into a staging area of refresh_fraction*pool_size samples. Each self.refresh()
+    swaps the staged samples in place of the oldest ones in the pool, so
+    every sample stays in the pool for 1/refresh_fraction refreshes.
+    """
+    def __init__(
+            self,
+            source: Callable,
+            pool_size: int,
+            refresh_fraction: float = 0.25,
+            seed: int = 0) -> None:
+        if not 0 < refresh_fraction <= 1:
+            raise ValueError(f'refresh_fraction must be in (0, 1], got {refresh_fraction}')
+        self.source = source
+        self.pool_size = pool_size
+        self.refresh_size = max(1, round(pool_size * refresh_fraction))
+        self._rng = np.random.default_rng(seed)
+        self._pool: tuple[np.ndarray, ...] | None = None
+        self._staging: tuple[np.ndarray, ...] | None = None
+        self._staged = 0
+        # Position of the oldest samples in the pool, replaced by the next refresh
+        self._oldest = 0
+        self._lock = threading.Lock()
+        self._staging_ready = threading.Condition(self._lock)
+        self._stop_event = threading.Event()
+        self._producer: threading.Thread | None = None
+        self._producer_error: BaseException | None = None
+        # Statistics, see self.stats()
+        self._draws = np.zeros(pool_size, dtype=np.int64)
+        self.refreshes = 0
+        self.replaced_draws = 0
+        self.wait_time = 0.0
+
+    @staticmethod
+    def _as_batch(item) -> tuple[np.ndarray, ...]:
+        img, label, bbox = item
+        if np.ndim(label) == 2:
+            # Single sample (8,8 label)
+            return np.asarray(img)[None], np.asarray(label)[None], np.asarray(bbox)[None]
+        return np.asarray(img), np.asarray(label), np.asarray(bbox)
+
+    @staticmethod
+    def _allocate(batch: tuple[np.ndarray, ...], size: int) -> tuple[np.ndarray, ...]:
+        return tuple(np.empty([size, *array.shape[1:]], dtype=array.dtype) for array in batch)
+
+    def fill(self) -> float:
+        """
+        Renders the whole pool synchronously (before the training starts).
+        Returns the time it took in seconds.
+        """
+        start = time.perf_counter()
+        filled = 0
+        for item in self.source():
+            batch = self._as_batch(item)
+            if self._pool is None:
+                self._pool = self._allocate(batch, self.pool_size)
+            n = min(len(batch[0]), self.pool_size - filled)
+            for pool_array, array in zip(self._pool, batch):
+                pool_array[filled:filled + n] = array[:n]
+            filled += n
+            if filled == self.pool_size:
+                break
+        return time.perf_counter() - start
+
+    def _produce(self) -> None:
+        try:
+            for item in self.source():
+                batch = self._as_batch(item)
+                used = 0
+                while used < len(batch[0]):
+                    with self._staging_ready:
+                        while self._staged == self.refresh_size and not self._stop_event.is_set():
+                            self._staging_ready.wait(timeout=0.1)
+                        if self._stop_event.is_set():
+                            return
+                        if self._staging is None:
+                            self._staging = self._allocate(batch, self.refresh_size)
+                        n = min(len(batch[0]) - used, self.refresh_size - self._staged)
+                        for staging_array, array in zip(self._staging, batch):
+                            staging_array[self._staged:self._staged + n] = array[used:used + n]
+                        self._staged += n
+                        used += n
+                        self._staging_ready.notify_all()
+        except BaseException as error:
+            with self._staging_ready:
+                self._producer_error = error
+                self._staging_ready.notify_all()
+
+    def start(self) -> None:
+        """
+        Fills the pool (if not done yet) and starts the background producer
+        """
+        if self._pool is None:
+            self.fill()
+        self._stop_event.clear()
+        self._producer = threading.Thread(target=self._produce, daemon=True)
+        self._producer.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._producer is not None:
+            with self._staging_ready:
+                self._staging_ready.notify_all()
+            self._producer.join()
+            self._producer = None
+
+    def refresh(self) -> float:
+        """
+        Replaces the oldest refresh_size samples of the pool by the staged ones.
+        Waits for the producer, if it has not staged enough samples yet.
+        Returns the waiting time in seconds.
+        """
+        start = time.perf_counter()
+        with self._staging_ready:
+            while self._staged < self.refresh_size:
+                if self._producer_error is not None:
+                    raise RuntimeError("Replay buffer producer failed") from self._producer_error
+                if self._producer is None or not self._producer.is_alive():
+                    raise RuntimeError("Replay buffer producer is not running, call start() first")
+                self._staging_ready.wait(timeout=0.1)
+            waited = time.perf_counter() - start
+            slots = (self._oldest + np.arange(self.refresh_size)) % self.pool_size
+            for pool_array, staging_array in zip(self._pool, self._staging):
+                pool_array[slots] = staging_array
+            self.replaced_draws += int(self._draws[slots].sum())
+            self._draws[slots] = 0
+            self._oldest = int(slots[-1] + 1) % self.pool_size
+            self._staged = 0
+            self.refreshes += 1
+            self._staging_ready.notify_all()
+        self.wait_time += waited
+        return waited
+
+    def sample(self, batch_size: int) -> tuple[np.ndarray, ...]:
+        """
+        Batch of samples drawn uniformly (with replacement) from the pool
+        """
+        with self._lock:
+            idx = self._rng.integers(0, self.pool_size, batch_size)
+            np.add.at(self._draws, idx, 1)
+            return tuple(pool_array[idx] for pool_array in self._pool)
+
+    def batches(self, batch_size: int):
+        """
+        Python generator of batches drawn from the pool
+        """
+        while True:
+            yield self.sample(batch_size)
+
+    def dataset(self, batch_size: int) -> tf.data.Dataset:
+        """
+        Endless tf dataset of batches drawn from the pool, with the same
+        elements as ChessBoardGenerator.tfGenerator(batch_size=batch_size)
+        """
+        if self._pool is None:
+            self.fill()
+        img, label, bbox = self._pool
+        return tf.data.Dataset.from_generator(
+            lambda: self.batches(batch_size),
+            output_types=(tf.uint8, tf.int32, tf.float32),
+            output_shapes=(
+                [batch_size, *img.shape[1:]],
+                [batch_size, *label.shape[1:]],
+                [batch_size, *bbox.shape[1:]])
+        )
+
+    def stats(self) -> dict:
+        """
+        Number of refreshes, total time the training waited for the producer
+        and mean number of draws of the samples replaced so far
+        """
+        replaced = self.refreshes * self.refresh_size
+        return {
+            "pool_size": self.pool_size,
+            "refresh_size": self.refresh_size,
+            "refreshes": self.refreshes,
+            "wait_time_s": self.wait_time,
+            "mean_reuse": self.replaced_draws / replaced if replaced else 0.0,
+        }
+
+
+def batches_of(source: Callable, batch_size: int):
+    """
+    Python generator of batches from the source yielding either
+    single samples (stacked here) or batches of batch_size
+    """
+    chunk = []
+    for item in source():
+        if np.ndim(item[1]) == 3:
+            yield tuple(np.asarray(array) for array in item)
+            continue
+        chunk.append(item)
+        if len(chunk) == batch_size:
+            yield tuple(np.stack(arrays) for arrays in zip(*chunk))
+            chunk = []
+
+
+class HardExampleBuffer():
+    """
+    Ring buffer of up to capacity misclassified samples (image, label, bbox).
+    Batches passing through self.batches() get the replay_ratio part replaced by 
+    random hard examples; the last candidate_batches fresh batches are kept, so 
+    self.mine() can find the misclassified ones without rendering anything new.
+    """
+    def __init__(
+            self,
+            capacity: int,
+            replay_ratio: float = 0.25,
+            candidate_batches: int = 4,
+            seed: int = 0) -> None:
+        if not 0 <= replay_ratio < 1:
+            raise ValueError(f'replay_ratio must be in [0, 1), got {replay_ratio}')
+        self.capacity = capacity
+        self.replay_ratio = replay_ratio
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._examples: tuple[np.ndarray, ...] | None = None
+        self._size = 0
+        self._next = 0
+        self._candidates: deque = deque(maxlen=candidate_batches)
+        # Statistics, see self.stats()
+        self.fresh = 0
+        self.replayed = 0
+        self.mined = 0
+        self.solved = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, img: np.ndarray, label: np.ndarray, bbox: np.ndarray) -> None:
+        """
+        Stores the batch of examples, overwriting the oldest ones once full
+        """
+        with self._lock:
+            if self._examples is None:
+                self._examples = tuple(
+                    np.empty([self.capacity, *array.shape[1:]], dtype=array.dtype) 
+                        for array in (img, label, bbox))
+            for sample in range(len(img)):
+                for stored, array in zip(self._examples, (img, label, bbox)):
+                    stored[self._next] = array[sample]
+                self._next = (self._next + 1) % self.capacity
+                self._size = min(self._size + 1, self.capacity)
+
+    def mix(self, batch: tuple[np.ndarray, ...]) -> tuple[np.ndarray, ...]:
+        """
+        Copy of the batch with its first replay_ratio part replaced by random hard examples
+        """
+        batch_size = len(batch[0])
+        with self._lock:
+            n_replayed = min(round(batch_size * self.replay_ratio), self._size)
+            self.fresh += batch_size - n_replayed
+            if n_replayed == 0:
+                return batch
+            idx = self._rng.integers(0, self._size, n_replayed)
+            mixed = tuple(array.copy() for array in batch)
+            for array, stored in zip(mixed, self._examples):
+                array[:n_replayed] = stored[idx]
+            self.replayed += n_replayed
+        return mixed
+
+    def batches(self, source: Callable, batch_size: int):
+        """
+        Python generator of the source batches (see batches_of) mixed with the hard examples
+        """
+        for batch in batches_of(source, batch_size):
+            with self._lock:
+                self._candidates.append(batch)
+            yield self.mix(batch)
+
+    def dataset(
+            self, 
+            source: Callable, 
+            batch_size: int, 
+            image_shape: tuple[int, ...]) -> tf.data.Dataset:
+        """
+        tf dataset of self.batches(), with the same elements as 
+        ChessBoardGenerator.tfGenerator(batch_size=batch_size)
+        """
+        return tf.data.Dataset.from_generator(
+            lambda: self.batches(source, batch_size),
+            output_types=(tf.uint8, tf.int32, tf.float32),
+            output_shapes=(
+                [batch_size, *image_shape], 
+                [batch_size, const.BOARD_RANKS, const.BOARD_FILES], 
+                [batch_size, 4])
+        )
+
+    def mine(self, predict: Callable[[np.ndarray], np.ndarray]) -> int:
+        """
+        Predicts the (B,8,8) encodings of the kept candidate batches and of the stored
+        hard examples. Stored examples classified correctly by now are dropped,
+        misclassified candidates are added. Returns the number of new hard examples.
+        """
+        with self._lock:
+            candidates = list(self._candidates)
+            self._candidates.clear()
+            stored = None
+            if self._size:
+                stored = tuple(array[:self._size].copy() for array in self._examples)
+        if stored is not None:
+            still_hard = self._misclassified(predict, stored)
+            with self._lock:
+                self.solved += self._size - int(still_hard.sum())
+                self._size, self._next = 0, 0
+            if still_hard.any():
+                self.add(*(array[still_hard] for array in stored))
+        added = 0
+        for batch in candidates:
+            hard = self._misclassified(predict, batch)
+            if hard.any():
+                self.add(*(array[hard] for array in batch))
+                added += int(hard.sum())
+        self.mined += added
+        return added
+
+    @staticmethod
+    def _misclassified(predict: Callable, batch: tuple[np.ndarray, ...]) -> np.ndarray:
+        img, label, _ = batch
+        predicted = np.asarray(predict(img))
+        return (predicted != label).any(axis=(1, 2))
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "capacity": self.capacity,
+            "fresh": self.fresh,
+            "replayed": self.replayed,
+            "mined": self.mined,
+            "solved": self.solved,
+        }
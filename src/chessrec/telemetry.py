@@ -0,0 +1,119 @@
+import os
+import csv
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from chessrec.profiling import StageProfiler
+
+
+"""
+Input pipeline telemetry of the training - tells whether the training steps
+wait for the data (generator bound) or not (compute bound)
+"""
+
+class PipelineTelemetry(tf.keras.callbacks.Callback):
+    """
+    Keras callback recording per epoch the throughput, the step times and the part
+    of the steps spent waiting for the input batch, plus the per-stage times of
+    the generator (if its profiler is given). One row per epoch is appended to
+    log_path - JSON lines if it ends with .json, CSV otherwise.
+    The input wait is measured only on datasets passed through self.mark_dataset().
+    The generator stage times cover everything the profiled generator rendered during
+    the epoch, divided by the training steps - besides the training batches also the
+    validation set (unless fixed by --val_cache/--load_val_dataset) and the samples
+    staged by the replay buffer producer, so they are an upper bound per training step.
+    """
+    def __init__(
+            self,
+            batch_size: int,
+            log_path: str,
+            generator_profiler: StageProfiler | None = None,
+            generator_stages: list[str] | None = None) -> None:
+        super().__init__()
+        self.batch_size = batch_size
+        self.log_path = log_path
+        self.generator_profiler = generator_profiler
+        self.generator_stages = generator_stages or []
+        self._arrival: float | None = None
+        # Added to the keras epoch number, for training loops calling fit(epochs=1) per epoch
+        self.epoch_offset = 0
+
+    def _record_arrival(self) -> np.int32:
+        self._arrival = time.perf_counter()
+        return np.int32(0)
+
+    def mark_dataset(self, dataset: tf.data.Dataset) -> tf.data.Dataset:
+        """
+        Appends a (non-prefetched) step to the dataset, recording when
+        the training step actually got its batch
+        """
+        def mark(*element):
+            marker = tf.numpy_function(self._record_arrival, [], tf.int32, stateful=True)
+            with tf.control_dependencies([marker]):
+                return tf.nest.map_structure(tf.identity, element)
+        # The marker must run when the batch is consumed, not ahead in an injected prefetch
+        options = tf.data.Options()
+        options.experimental_optimization.inject_prefetch = False
+        return dataset.map(mark).with_options(options)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._step_times: list[float] = []
+        self._input_waits: list[float] = []
+        self._epoch_start = time.perf_counter()
+        self._train_end = self._epoch_start
+        if self.generator_profiler is not None:
+            self.generator_profiler.reset()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._arrival = None
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._train_end = time.perf_counter()
+        self._step_times.append(self._train_end - self._step_start)
+        if self._arrival is not None:
+            self._input_waits.append(max(0.0, self._arrival - self._step_start))
+
+    def epoch_row(self, epoch: int) -> dict:
+        steps = len(self._step_times)
+        step_times = np.array(self._step_times or [0.0]) * 1000
+        input_waits = np.array(self._input_waits or [0.0]) * 1000
+        train_time = self._train_end - self._epoch_start
+        row = {
+            "epoch": self.epoch_offset + epoch,
+            "steps": steps,
+            "samples_per_s": steps * self.batch_size / train_time if train_time > 0 else 0.0,
+            "step_time_ms": float(step_times.mean()),
+            "step_time_p90_ms": float(np.percentile(step_times, 90)),
+            "input_wait_ms": float(input_waits.mean()),
+            "input_wait_p90_ms": float(np.percentile(input_waits, 90)),
+            "input_wait_fraction": float(input_waits.sum() / step_times.sum()) if step_times.sum() else 0.0,
+        }
+        if self.generator_profiler is not None:
+            summary = self.generator_profiler.summary()
+            for stage in self.generator_stages:
+                # Generator time per training step, split by stage
+                total = summary[stage]["total_s"] if stage in summary else 0.0
+                row[f'generator_{stage}_ms'] = total / steps * 1000 if steps else 0.0
+        return row
+
+    def _append(self, row: dict) -> None:
+        if self.log_path.endswith(".json"):
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(row) + "\n")
+            return
+        new_file = not os.path.isfile(self.log_path) or os.path.getsize(self.log_path) == 0
+        with open(self.log_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def on_epoch_end(self, epoch, logs=None):
+        row = self.epoch_row(epoch)
+        self._append(row)
+        print(f'Input pipeline: {row["samples_per_s"]:.1f} samples/s, step {row["step_time_ms"]:.1f} ms, '
+              f'waiting for input {row["input_wait_ms"]:.1f} ms ({row["input_wait_fraction"]:.0%})')